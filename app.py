@@ -1,12 +1,19 @@
 import os
+import io
+import csv
 import json
+import time
+import hmac
+import base64
+import datetime
 import threading
 from functools import wraps
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, Response
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_babel import Babel, gettext, ngettext, lazy_gettext as _l
 from werkzeug.security import generate_password_hash, check_password_hash
 import scanner
+import plex_clients
 
 # Version
 __version__ = '1.0.1'
@@ -34,6 +41,39 @@ LANGUAGES = {
 # Initialize Babel without app (will be bound later with init_app)
 babel = Babel()
 
+# Settings without a field in the UI, kept when the settings page is saved
+ADVANCED_SETTINGS = [
+    'event_debounce',
+    'event_max_wait',
+    'reconcile_interval',
+    'servers',
+    'scan_concurrency',
+    'scan_throttle',
+    'content_dedupe',
+    'content_reuse_days',
+    'path_mappings',
+    'preflight',
+    'preflight_short_circuit',
+    'predict_failures',
+    'signature_min_samples',
+    'signature_reverify_every',
+    'breaker_threshold',
+    'breaker_backoff',
+    'breaker_max_backoff',
+    'history_sample_interval',
+    'history_raw_days',
+    'history_hourly_days',
+    'transcode_budget',
+    'reverify_days',
+    'reverify_fraction',
+    'reverify_boost_days',
+    'reverify_boost_factor',
+    'api_key',
+    'probe_mode',
+    'probe_offsets',
+    'probe_window_bytes',
+]
+
 CONFIG_DIR = '/config'
 CONFIG_PATH = os.path.join(CONFIG_DIR, 'settings.json')
 
@@ -67,6 +107,12 @@ def is_auth_disabled():
     """Check if authentication is disabled in settings."""
     return load_settings().get('auth_disabled', False)
 
+def has_valid_api_key():
+    """Scripts (e.g. Sonarr/Radarr hooks) can authenticate with the `api_key` setting in an X-Api-Key header."""
+    api_key = load_settings().get('api_key')
+    supplied = request.headers.get('X-Api-Key')
+    return bool(api_key and supplied and hmac.compare_digest(api_key, supplied))
+
 def optional_login_required(f):
     """Decorator that requires login unless auth_disabled is True."""
     @wraps(f)
@@ -82,6 +128,18 @@ def optional_login_required(f):
                 return login_manager.unauthorized()
     return decorated_function
 
+def api_key_or_login_required(f):
+    """
+    Like optional_login_required, but also accepts the API key. Only for the
+    endpoints scripts need; the key must not unlock settings or exports.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if has_valid_api_key():
+            return f(*args, **kwargs)
+        return optional_login_required(f)(*args, **kwargs)
+    return decorated_function
+
 @app.before_request
 def before_request():
     """Handle locale selection and auto-login for disabled auth."""
@@ -226,12 +284,89 @@ def set_language(lang):
 @app.route('/api/status')
 @optional_login_required
 def get_status():
-    return jsonify(scanner.state)
+    return jsonify(scanner.read_state())
+
+@app.route('/api/scanner/<command>', methods=['POST'])
+@optional_login_required
+def scanner_command(command):
+    """Restart or stop the scanner, wherever it is running."""
+    if command not in ('restart', 'stop'):
+        return jsonify({'success': False, 'error': 'Invalid command'}), 400
+    scanner.send_command(command)
+    return jsonify({'success': True})
+
+@app.route('/api/scan', methods=['POST'])
+@api_key_or_login_required
+def start_scan_job():
+    """
+    Scans specific items right away, ahead of a running scan and ignoring the PASS cache.
+    Body: {"rating_keys": [...]} or {"library": "..."} or {"path_prefix": "..."}, optionally "server".
+    """
+    data = request.get_json(silent=True) or {}
+    rating_keys = data.get('rating_keys') or data.get('ratingKeys')
+    if rating_keys:
+        if not isinstance(rating_keys, list):
+            rating_keys = [rating_keys]
+        try:
+            job_request = {'rating_keys': [int(k) for k in rating_keys]}
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'rating_keys must be numbers'}), 400
+    elif data.get('library'):
+        job_request = {'library': data['library']}
+    elif data.get('path_prefix'):
+        job_request = {'path_prefix': data['path_prefix']}
+    else:
+        return jsonify({'success': False, 'error': 'Provide rating_keys, library or path_prefix'}), 400
+
+    try:
+        servers = [s['name'] for s in scanner.get_servers(load_settings())]
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    server = data.get('server') or (servers[0] if servers else None)
+    if server not in servers:
+        return jsonify({'success': False, 'error': 'Unknown or unconfigured server'}), 400
+
+    job_id = scanner.create_scan_job(server, job_request)
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
+@app.route('/api/scan/<job_id>')
+@api_key_or_login_required
+def get_scan_job(job_id):
+    """Progress and per-file results of a scan job."""
+    job = scanner.get_scan_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+def admin_required(f):
+    """Like optional_login_required, but never open to everyone: needs a login or the API key."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if has_valid_api_key() or (not is_auth_disabled() and current_user.is_authenticated):
+            return f(*args, **kwargs)
+        return jsonify({'success': False, 'error': 'Requires a login or the API key'}), 403
+    return decorated_function
+
+@app.route('/api/admin/profile/<action>', methods=['POST'])
+@admin_required
+def profile_scanner(action):
+    """
+    Profiles the scanner. Actions: cpu_start {seconds, interval}, cpu_stop,
+    cpu_result {fmt: collapsed|text|pstats}, memory_snapshot {limit},
+    memory_diff {old, new, limit, group_by}, memory_stop.
+    """
+    options = request.get_json(silent=True) or {}
+    result = scanner.run_profile_command(action, options)
+    if action == 'cpu_result' and result.get('pstats'):
+        return Response(base64.b64decode(result['pstats']), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename=findrr-scanner.pstats'})
+    if action == 'cpu_result' and result.get('collapsed') is not None:
+        return Response(result['collapsed'], mimetype='text/plain')
+    return jsonify(result), (200 if result.get('success') else 400)
 
 @app.route('/api/test_connection', methods=['POST'])
 @optional_login_required
 def test_connection():
-    from plexapi.server import PlexServer
     data = request.json
     
     # Load existing settings to find the real token if the UI sent a mask
@@ -244,8 +379,9 @@ def test_connection():
         token = current_settings.get('plex_token')
 
     try:
-        # Use the 'token' variable we just validated instead of data['plex_token']
-        plex = PlexServer(url, token)
+        # Use the 'token' variable we just validated instead of data['plex_token'].
+        # Always health check a cached client so the test reflects the server right now.
+        plex = plex_clients.get_client(url, token, max_age=0)
         libs = [s.title for s in plex.library.sections() if s.type in ['movie', 'show']]
         return jsonify({'success': True, 'libraries': libs})
     except Exception as e:
@@ -254,15 +390,20 @@ def test_connection():
 @app.route('/api/search_plex', methods=['POST'])
 @optional_login_required
 def search_plex():
-    from plexapi.server import PlexServer
     settings = load_settings()
     query = request.json.get('query')
     
     if not query or not settings.get('plex_url') or not settings.get('plex_token'):
         return jsonify({'results': []})
 
+    # The search box fires on every keystroke, so answer repeats from the cache
+    cache_key = plex_clients.client_key(settings['plex_url'], settings['plex_token']) + (query.strip().lower(),)
+    cached = plex_clients.search_cache.get(cache_key)
+    if cached is not None:
+        return jsonify({'results': cached})
+
     try:
-        plex = PlexServer(settings['plex_url'], settings['plex_token'])
+        plex = plex_clients.get_client(settings['plex_url'], settings['plex_token'])
         # Search and filter for Movies and Episodes only
         results = plex.search(query)
         output = []
@@ -280,6 +421,7 @@ def search_plex():
                     'title': title,
                     'type': 'Episode'
                 })
+        plex_clients.search_cache.set(cache_key, output)
         return jsonify({'results': output})
     except Exception as e:
         return jsonify({'error': str(e), 'results': []})
@@ -289,6 +431,75 @@ def search_plex():
 def get_history():
     return jsonify(scanner.get_recent_history())
 
+def parse_time(value, default):
+    """Accepts epoch seconds or an ISO date/time."""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+@app.route('/api/history/series')
+@optional_login_required
+def get_history_series():
+    """
+    Throughput over time: ?since=...&until=...&resolution=raw|hour|day&kind=interval|scan
+    since/until take epoch seconds or ISO dates and default to the last 24 hours.
+    """
+    resolution = request.args.get('resolution', 'hour')
+    kind = request.args.get('kind', 'interval')
+    if resolution not in ('raw', 'hour', 'day') or kind not in ('interval', 'scan'):
+        return jsonify({'success': False, 'error': 'Invalid resolution or kind'}), 400
+    try:
+        until = parse_time(request.args.get('until'), time.time())
+        since = parse_time(request.args.get('since'), until - 86400)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid time range'}), 400
+    return jsonify(scanner.get_history_series(since, until, resolution, kind))
+
+@app.route('/api/export/<fmt>')
+@optional_login_required
+def export_results(fmt):
+    """
+    Streams every per-file result as CSV or NDJSON.
+    Filters: ?status=FAIL&audio_status=...&library=...&server=...&since=2024-01-01&until=2024-02-01
+    (status, audio_status, library and server accept several values, comma separated or repeated).
+    """
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'error': 'Invalid format'}), 400
+
+    filters = {}
+    for key in ('server', 'status', 'audio_status', 'library'):
+        values = [v.strip() for arg in request.args.getlist(key) for v in arg.split(',') if v.strip()]
+        if values:
+            filters[key] = values
+    filters['since'] = request.args.get('since')
+    filters['until'] = request.args.get('until')
+    rows = scanner.iter_file_checks(filters)
+
+    if fmt == 'ndjson':
+        def generate():
+            for row in rows:
+                yield json.dumps(dict(zip(scanner.EXPORT_COLUMNS, row))) + '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(scanner.EXPORT_COLUMNS)
+            for i, row in enumerate(rows, 1):
+                writer.writerow(row)
+                # Send the buffer in chunks of a few hundred rows
+                if i % 500 == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        mimetype = 'text/csv'
+
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=findrr-results.{fmt}'})
 
 # Serve favicon files placed under templates/favicon at /favicon/*
 @app.route('/favicon/<path:filename>')
@@ -318,8 +529,18 @@ def save_settings_route():
     if 'per_library_settings' not in new_data and 'per_library_settings' in old_settings:
         new_data['per_library_settings'] = old_settings['per_library_settings']
     
+    # Preserve advanced settings that are only edited in settings.json
+    for key in ADVANCED_SETTINGS:
+        if key not in new_data and key in old_settings:
+            new_data[key] = old_settings[key]
+    
     save_settings(new_data)
-    scanner.restart_event.set()
+    
+    # Drop the cached client if the server connection changed
+    if (new_data.get('plex_url'), new_data.get('plex_token')) != (old_settings.get('plex_url'), old_settings.get('plex_token')):
+        plex_clients.invalidate(old_settings.get('plex_url'), old_settings.get('plex_token'))
+    
+    scanner.send_command('restart')
     
     return jsonify({'success': True})
 
@@ -348,9 +569,21 @@ def save_library_settings():
     # Update the settings
     settings['per_library_settings'][library_name]['target_languages'] = target_languages
     settings['per_library_settings'][library_name]['target_audio_languages'] = target_audio_languages
+
+    # Optional schedule; only changed when sent
+    for key in ('scan_interval', 'scan_window', 'scan_days'):
+        if key in data:
+            if data[key] in (None, '', []):
+                settings['per_library_settings'][library_name].pop(key, None)
+            else:
+                settings['per_library_settings'][library_name][key] = data[key]
+    try:
+        scanner.parse_library_schedule(settings['per_library_settings'][library_name])
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     save_settings(settings)
-    scanner.restart_event.set()
+    scanner.send_command('restart')
     
     return jsonify({'success': True})
 
@@ -364,7 +597,10 @@ def get_library_settings(library_name):
     
     return jsonify({
         'target_languages': lib_settings.get('target_languages', ''),
-        'target_audio_languages': lib_settings.get('target_audio_languages', '')
+        'target_audio_languages': lib_settings.get('target_audio_languages', ''),
+        'scan_interval': lib_settings.get('scan_interval'),
+        'scan_window': lib_settings.get('scan_window'),
+        'scan_days': lib_settings.get('scan_days')
     })
 
 @app.route('/api/change_password', methods=['POST'])
@@ -395,7 +631,9 @@ def change_password():
     
     return jsonify({'success': True, 'message': 'Password changed successfully'})
 
-scanner.start_background_thread()
+# With SCANNER_MODE=external the scan loop runs in its own process (python scanner.py)
+if not scanner.is_external():
+    scanner.start_background_thread()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=6580)
\ No newline at end of file
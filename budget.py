@@ -0,0 +1,107 @@
+import time
+import datetime
+import threading
+
+class TokenBucket:
+    """
+    Refills at `rate_per_hour` and holds at most one hour's worth. Usage is
+    charged after the fact, so the level can drop below zero; callers wait
+    until it is positive again.
+    """
+    def __init__(self, rate_per_hour):
+        self.rate_per_hour = rate_per_hour
+        self.level = rate_per_hour
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.rate_per_hour, self.level + (now - self.updated) * self.rate_per_hour / 3600)
+        self.updated = now
+
+    def seconds_until_available(self):
+        self.refill()
+        if self.level > 0:
+            return 0
+        return -self.level * 3600 / self.rate_per_hour
+
+def parse_window(window):
+    """'22:00-06:00' -> (start minute, end minute). Windows may wrap past midnight."""
+    def to_minutes(hhmm):
+        hours, minutes = (int(x) for x in hhmm.strip().split(':'))
+        if not (0 <= hours <= 24 and 0 <= minutes < 60 and hours * 60 + minutes <= 1440):
+            raise ValueError
+        return hours * 60 + minutes
+    try:
+        start, end = window.split('-')
+        return to_minutes(start), to_minutes(end)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time window '{window}', expected HH:MM-HH:MM")
+
+def in_window(window, now):
+    start, end = parse_window(window)
+    minute = now.hour * 60 + now.minute
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+def minutes_until_window(windows, now):
+    minute = now.hour * 60 + now.minute
+    return min((parse_window(w)[0] - minute) % 1440 for w in windows)
+
+class TranscodeBudget:
+    """
+    Limits the transcoded bytes and transcoder seconds a scan may use per hour.
+
+    config: {'bytes_per_hour': ..., 'seconds_per_hour': ..., 'windows': ['22:00-06:00', ...]}
+    A missing or zero limit means unlimited. With windows, transcode tests
+    only run inside them.
+    """
+    def __init__(self, config):
+        self.windows = config.get('windows') or []
+        for window in self.windows:
+            parse_window(window)  # Fail early on a malformed window
+        self.buckets = {}
+        if config.get('bytes_per_hour'):
+            self.buckets['bytes'] = TokenBucket(float(config['bytes_per_hour']))
+        if config.get('seconds_per_hour'):
+            self.buckets['seconds'] = TokenBucket(float(config['seconds_per_hour']))
+        self.used = {'bytes': 0, 'seconds': 0.0}
+        self.lock = threading.Lock()
+
+    def reset_usage(self):
+        with self.lock:
+            self.used = {'bytes': 0, 'seconds': 0.0}
+
+    def charge(self, bytes_read, seconds):
+        with self.lock:
+            self.used['bytes'] += bytes_read
+            self.used['seconds'] += seconds
+            for name, amount in (('bytes', bytes_read), ('seconds', seconds)):
+                bucket = self.buckets.get(name)
+                if bucket:
+                    bucket.refill()
+                    bucket.level -= amount
+
+    def wait_time(self):
+        """Seconds until the next transcode test may start, and why it has to wait."""
+        now = datetime.datetime.now()
+        if self.windows and not any(in_window(w, now) for w in self.windows):
+            return minutes_until_window(self.windows, now) * 60, 'outside transcode window'
+        with self.lock:
+            waits = [(bucket.seconds_until_available(), f"{name} per hour") for name, bucket in self.buckets.items()]
+        waits = [w for w in waits if w[0] > 0]
+        if waits:
+            return max(waits)
+        return 0, None
+
+    def snapshot(self):
+        with self.lock:
+            for bucket in self.buckets.values():
+                bucket.refill()
+            return {
+                'bytes_used': self.used['bytes'],
+                'seconds_used': round(self.used['seconds'], 1),
+                'bytes_available': int(self.buckets['bytes'].level) if 'bytes' in self.buckets else None,
+                'seconds_available': round(self.buckets['seconds'].level, 1) if 'seconds' in self.buckets else None,
+                'windows': self.windows
+            }
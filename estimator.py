@@ -0,0 +1,93 @@
+import time
+import threading
+import collections
+
+# Weight of the newest sample in the moving averages
+ALPHA = 0.1
+
+# Seconds per part before anything has been measured
+DEFAULT_COSTS = {
+    'skip': 0.005,      # Cached PASS, only a database lookup
+    'local': 0.05,      # Verdict without a transcode (pre-flight, reused, predicted)
+    'video': 5.0,       # Video transcode test, including reload and audio check
+    'subtitle': 5.0,    # One subtitle burn-in test
+}
+
+# items/s is measured over this many seconds
+RATE_WINDOW = 60
+
+class ScanEstimator:
+    """
+    Estimates how long the rest of a server's scan takes.
+
+    Keeps moving averages of what a part costs (cached skip, local verdict,
+    video test, each subtitle test) and how many subtitle tests a tested part
+    needs, and applies them to the parts still expected to be skipped or tested.
+    The averages carry over from one scan to the next.
+    """
+    def __init__(self):
+        self.costs = dict(DEFAULT_COSTS)
+        self.subtitles_per_test = 1.0
+        self.local_share = 0.0
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.expected = {'skip': 0, 'test': 0}
+        self.done = {'skip': 0, 'test': 0}
+        self.recent = collections.deque()
+        self.concurrency = 1
+        self.throttle = 0
+
+    def _average(self, key, value):
+        self.costs[key] += ALPHA * (value - self.costs[key])
+
+    def forecast(self, parts_to_skip, parts_to_test, concurrency=1, throttle=0):
+        """Starts a scan with the known mix of parts. Returns the forecast ETA in seconds."""
+        with self.lock:
+            self.reset()
+            self.expected = {'skip': parts_to_skip, 'test': parts_to_test}
+            self.concurrency = max(1, concurrency)
+            self.throttle = throttle
+        return self.eta()
+
+    def record(self, kind, seconds, subtitle_tests=0):
+        """
+        Records a finished part. kind: 'skip', 'local' or 'video'.
+        For 'video', `seconds` excludes the subtitle tests, which are recorded separately.
+        """
+        with self.lock:
+            self._average(kind, seconds)
+            if kind == 'skip':
+                self.done['skip'] += 1
+            else:
+                self.done['test'] += 1
+                self.local_share += ALPHA * ((1.0 if kind == 'local' else 0.0) - self.local_share)
+                if kind == 'video':
+                    self.subtitles_per_test += ALPHA * (subtitle_tests - self.subtitles_per_test)
+            now = time.time()
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.popleft()
+
+    def record_subtitle(self, seconds):
+        with self.lock:
+            self._average('subtitle', seconds)
+
+    def eta(self):
+        with self.lock:
+            skip_left = max(0, self.expected['skip'] - self.done['skip'])
+            test_left = max(0, self.expected['test'] - self.done['test'])
+            test_cost = (self.local_share * self.costs['local'] +
+                         (1 - self.local_share) * (self.costs['video'] + self.throttle +
+                                                   self.subtitles_per_test * self.costs['subtitle']))
+            return int((skip_left * self.costs['skip'] + test_left * test_cost) / self.concurrency)
+
+    def items_per_sec(self):
+        with self.lock:
+            now = time.time()
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.popleft()
+            if not self.recent:
+                return 0.0
+            return round(len(self.recent) / min(RATE_WINDOW, max(1.0, now - self.recent[0])), 2)
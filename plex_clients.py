@@ -0,0 +1,87 @@
+import time
+import hashlib
+import threading
+import collections
+from plexapi.server import PlexServer
+
+# Cached clients are re-checked against /identity after this many seconds
+HEALTH_CHECK_INTERVAL = 60
+
+# Canary search results
+SEARCH_CACHE_TTL = 300
+SEARCH_CACHE_SIZE = 128
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def client_key(url, token):
+    """Cache key for a server. The token is hashed so it never sits in a key in plain text."""
+    return ((url or '').rstrip('/'), hashlib.sha256((token or '').encode()).hexdigest())
+
+def get_client(url, token, max_age=HEALTH_CHECK_INTERVAL):
+    """
+    Returns a process-wide PlexServer for (url, token). A cached client that
+    hasn't been used for `max_age` seconds is health checked first and rebuilt
+    if the server no longer answers.
+    """
+    key = client_key(url, token)
+    with _clients_lock:
+        entry = _clients.get(key)
+
+    if entry:
+        if time.time() - entry['checked'] < max_age:
+            return entry['plex']
+        try:
+            entry['plex'].query('/identity')
+            entry['checked'] = time.time()
+            return entry['plex']
+        except Exception as e:
+            print(f"Cached Plex client for {key[0]} failed health check: {e}")
+            invalidate(url, token)
+
+    plex = PlexServer(url, token)
+    with _clients_lock:
+        _clients[key] = {'plex': plex, 'checked': time.time()}
+    return plex
+
+def invalidate(url=None, token=None):
+    """Drops the cached client for (url, token), or every client when called without arguments."""
+    with _clients_lock:
+        if url is None:
+            _clients.clear()
+        else:
+            _clients.pop(client_key(url, token), None)
+    search_cache.clear()
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after `ttl` seconds."""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if time.time() >= expires:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
@@ -0,0 +1,91 @@
+import time
+import threading
+
+# Timeline entry types we care about (Plex metadata type ids)
+WATCHED_TYPES = {1: 'movie', 4: 'episode'}
+
+# Timeline state 5 means Plex has finished processing the item,
+# state 9 means it was deleted.
+STATE_DONE = 5
+STATE_DELETED = 9
+
+class PlexEventListener:
+    """
+    Subscribes to the Plex notification websocket and collects newly added or
+    updated movies/episodes. Items are debounced so that a season pack import
+    is handed to the scanner as a single batch.
+    """
+    def __init__(self, plex, debounce=30, max_wait=300):
+        self.plex = plex
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._pending = {}
+        self._first_event = None
+        self._last_event = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def start(self):
+        from plexapi.alert import AlertListener
+        self._listener = AlertListener(self.plex, callback=self._on_alert, callbackError=self._on_error)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener:
+            try:
+                self._listener.stop()
+            except Exception:
+                pass
+        self._listener = None
+
+    def is_alive(self):
+        return self._listener is not None and self._listener.is_alive()
+
+    def _on_error(self, error):
+        print(f"Plex event listener error: {error}")
+
+    def _on_alert(self, data):
+        if data.get('type') != 'timeline':
+            return
+        for entry in data.get('TimelineEntry', []):
+            if entry.get('identifier') != 'com.plexapp.plugins.library':
+                continue
+            if entry.get('type') not in WATCHED_TYPES:
+                continue
+            if entry.get('state') != STATE_DONE or entry.get('metadataState') == 'deleted':
+                continue
+            item_id = entry.get('itemID')
+            if item_id:
+                self.add(item_id)
+
+    def add(self, rating_key):
+        now = time.time()
+        with self._lock:
+            self._pending[str(rating_key)] = now
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pop_batch(self):
+        """
+        Returns the pending rating keys once no new event has arrived for
+        `debounce` seconds (or `max_wait` has passed since the first one),
+        otherwise an empty list.
+        """
+        now = time.time()
+        with self._lock:
+            if not self._pending:
+                return []
+            quiet = now - self._last_event >= self.debounce
+            overdue = now - self._first_event >= self.max_wait
+            if not (quiet or overdue):
+                return []
+            batch = sorted(self._pending, key=self._pending.get)
+            self._pending = {}
+            self._first_event = None
+            self._last_event = None
+            return batch
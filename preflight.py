@@ -0,0 +1,257 @@
+import os
+import mmap
+import time
+
+# Pre-flight verdicts
+OK = 'OK'          # Header and stream table look sane
+WARN = 'WARN'      # Suspicious (e.g. truncated), still sent to Plex
+FAIL = 'FAIL'      # Hopeless, no point in asking Plex to transcode it
+UNKNOWN = 'UNKNOWN'  # Container we don't parse
+
+# Upper bound on elements/boxes walked per file so a corrupt file can't keep us busy
+MAX_ELEMENTS = 512
+
+# Extensions whose container we can recognise
+EXPECTED_CONTAINERS = {
+    '.mkv': 'matroska', '.mka': 'matroska', '.webm': 'matroska',
+    '.mp4': 'mp4', '.m4v': 'mp4', '.mov': 'mp4',
+    '.avi': 'avi',
+    '.ts': 'mpegts',
+}
+
+# Matroska element ids
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CLUSTER = 0x1F43B675
+MATROSKA_TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+
+# Top-level boxes a QuickTime/MP4 file may start with
+MP4_LEADING_BOXES = {b'ftyp', b'styp', b'moov', b'mdat', b'free', b'wide', b'skip', b'uuid', b'pnot', b'junk', b'pict', b'sidx'}
+
+MP4_HANDLER_TYPES = {b'vide': 'video', b'soun': 'audio', b'sbtl': 'subtitle', b'subt': 'subtitle', b'text': 'subtitle'}
+
+class Truncated(Exception):
+    pass
+
+def check_file(path):
+    """
+    Cheap local sanity check of a media file. Parses the container header and
+    stream table using bounded reads from a memory map.
+    Returns {'status', 'reason', 'container', 'streams', 'ms'}.
+    """
+    started = time.perf_counter()
+    result = _check(path)
+    result['ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+def _result(status, reason='', container=None, streams=None):
+    return {'status': status, 'reason': reason, 'container': container, 'streams': streams or {}}
+
+def _check(path):
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return _result(FAIL, 'Empty file')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _check_container(mm, size, os.path.splitext(path)[1].lower())
+    except OSError as e:
+        return _result(UNKNOWN, f"Could not read file: {e}")
+
+def _check_container(mm, size, ext):
+    head = mm[:16]
+    expected = EXPECTED_CONTAINERS.get(ext)
+
+    try:
+        if head[:4] == b'\x1a\x45\xdf\xa3':
+            return _check_matroska(mm, size)
+        if head[4:8] in MP4_LEADING_BOXES:
+            return _check_mp4(mm, size)
+        if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+            return _check_avi(mm, size)
+        # 188-byte packets (TS), or 192-byte packets with a 4-byte timestamp first (BDAV/M2TS)
+        for packet, sync in ((188, 0), (192, 4)):
+            if size > sync + 2 * packet and all(mm[sync + n * packet] == 0x47 for n in range(3)):
+                return _result(OK, container='mpegts')
+    except Truncated as e:
+        return _result(FAIL, f"Truncated header: {e}", expected)
+
+    # Magic bytes we don't recognise aren't proof of corruption, so Plex still gets to try
+    if expected:
+        if not any(mm[:min(size, 4096)]):
+            return _result(WARN, 'Missing header (file starts with zeros)', expected)
+        return _result(UNKNOWN, f"Unrecognised {expected} header", expected)
+    return _result(UNKNOWN, 'Container not checked')
+
+# --- Matroska ---
+
+def _read_vint(mm, pos, size, is_id=False):
+    """Reads an EBML variable length integer. Returns (value, length); value is None for 'unknown size'."""
+    if pos >= size:
+        raise Truncated('element header past end of file')
+    first = mm[pos]
+    if first == 0:
+        raise ValueError('invalid EBML length')
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+    if pos + length > size:
+        raise Truncated('element header past end of file')
+    if is_id:
+        return int.from_bytes(mm[pos:pos + length], 'big'), length
+    value = first & (mask - 1)
+    for b in mm[pos + 1:pos + length]:
+        value = (value << 8) | b
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+def _read_element(mm, pos, size):
+    """Returns (id, data_start, data_size) of the element at pos."""
+    element_id, id_len = _read_vint(mm, pos, size, is_id=True)
+    data_size, size_len = _read_vint(mm, pos + id_len, size)
+    return element_id, pos + id_len + size_len, data_size
+
+def _check_matroska(mm, size):
+    try:
+        element_id, data, data_size = _read_element(mm, 0, size)
+        pos = data + (data_size or 0)
+        element_id, seg_start, seg_size = _read_element(mm, pos, size)
+    except ValueError:
+        return _result(FAIL, 'Corrupt EBML header', 'matroska')
+    if element_id != SEGMENT:
+        return _result(FAIL, 'Missing Matroska segment', 'matroska')
+
+    seg_end = size if seg_size is None else seg_start + seg_size
+    truncated = seg_end > size
+    seg_end = min(seg_end, size)
+
+    pos = seg_start
+    for _ in range(MAX_ELEMENTS):
+        if pos >= seg_end:
+            break
+        try:
+            element_id, data, data_size = _read_element(mm, pos, size)
+        except (ValueError, Truncated):
+            break
+        if element_id == TRACKS:
+            try:
+                streams = _matroska_tracks(mm, data, min(seg_end, data + (data_size or 0)), size)
+            except (ValueError, Truncated):
+                return _result(FAIL, 'Corrupt track table', 'matroska')
+            if not streams:
+                return _result(FAIL, 'Track table is empty', 'matroska')
+            if truncated:
+                return _result(WARN, 'Truncated (segment extends past end of file)', 'matroska', streams)
+            return _result(OK, container='matroska', streams=streams)
+        if element_id == CLUSTER or data_size is None:
+            return _result(WARN, 'Track table not found before media data', 'matroska')
+        pos = data + data_size
+
+    if truncated:
+        return _result(FAIL, 'Truncated before the track table', 'matroska')
+    return _result(FAIL, 'No track table', 'matroska')
+
+def _matroska_tracks(mm, start, end, size):
+    streams = {}
+    pos = start
+    for _ in range(MAX_ELEMENTS):
+        if pos >= end:
+            break
+        element_id, data, data_size = _read_element(mm, pos, size)
+        if data_size is None:
+            break
+        if element_id == TRACK_ENTRY:
+            child = data
+            while child < data + data_size:
+                child_id, child_data, child_size = _read_element(mm, child, size)
+                if child_size is None:
+                    break
+                if child_id == TRACK_TYPE:
+                    track_type = int.from_bytes(mm[child_data:child_data + child_size], 'big')
+                    kind = MATROSKA_TRACK_TYPES.get(track_type, 'other')
+                    streams[kind] = streams.get(kind, 0) + 1
+                    break
+                child = child_data + child_size
+        pos = data + data_size
+    return streams
+
+# --- MP4 / QuickTime ---
+
+def _iter_boxes(mm, start, end, size):
+    """Yields (type, start, header_len, box_size) for the boxes between start and end."""
+    pos = start
+    for _ in range(MAX_ELEMENTS):
+        if pos + 8 > end:
+            return
+        box_size = int.from_bytes(mm[pos:pos + 4], 'big')
+        box_type = bytes(mm[pos + 4:pos + 8])
+        header = 8
+        if box_size == 1:
+            if pos + 16 > size:
+                raise Truncated(f"'{box_type.decode('latin-1')}' box")
+            box_size = int.from_bytes(mm[pos + 8:pos + 16], 'big')
+            header = 16
+        elif box_size == 0:
+            box_size = end - pos
+        if box_size < header:
+            raise ValueError(f"invalid size for '{box_type.decode('latin-1')}' box")
+        yield box_type, pos, header, box_size
+        pos += box_size
+
+def _check_mp4(mm, size):
+    moov = None
+    truncated_box = None
+    try:
+        for box_type, start, header, box_size in _iter_boxes(mm, 0, size, size):
+            if start + box_size > size:
+                truncated_box = box_type.decode('latin-1')
+            if box_type == b'moov':
+                moov = (start + header, start + box_size)
+    except ValueError as e:
+        return _result(FAIL, f"Corrupt box structure: {e}", 'mp4')
+
+    if moov is None:
+        return _result(FAIL, 'Missing moov atom (stream table)', 'mp4')
+    if moov[1] > size:
+        return _result(FAIL, 'Truncated moov atom', 'mp4')
+
+    streams = {}
+    try:
+        for box_type, start, header, box_size in _iter_boxes(mm, moov[0], moov[1], size):
+            if box_type == b'trak':
+                kind = _mp4_track_kind(mm, start + header, start + box_size, size)
+                streams[kind] = streams.get(kind, 0) + 1
+    except (ValueError, Truncated) as e:
+        return _result(FAIL, f"Corrupt stream table: {e}", 'mp4')
+
+    if not streams:
+        return _result(FAIL, 'Stream table has no tracks', 'mp4')
+    if truncated_box:
+        return _result(WARN, f"Truncated ('{truncated_box}' box extends past end of file)", 'mp4', streams)
+    return _result(OK, container='mp4', streams=streams)
+
+def _mp4_track_kind(mm, start, end, size):
+    for box_type, box_start, header, box_size in _iter_boxes(mm, start, end, size):
+        if box_type == b'mdia':
+            for child_type, child_start, child_header, child_size in _iter_boxes(mm, box_start + header, box_start + box_size, size):
+                if child_type == b'hdlr':
+                    # version/flags (4) + pre_defined (4) + handler_type (4)
+                    offset = child_start + child_header + 8
+                    return MP4_HANDLER_TYPES.get(bytes(mm[offset:offset + 4]), 'other')
+    return 'other'
+
+# --- AVI ---
+
+def _check_avi(mm, size):
+    riff_size = int.from_bytes(mm[4:8], 'little')
+    if size > 12 and mm[12:16] == b'LIST' and mm[20:24] == b'hdrl':
+        if riff_size + 8 > size:
+            return _result(WARN, 'Truncated (RIFF chunk extends past end of file)', 'avi')
+        return _result(OK, container='avi')
+    return _result(FAIL, 'Missing AVI header list', 'avi')
@@ -0,0 +1,215 @@
+import io
+import sys
+import time
+import base64
+import marshal
+import pstats
+import threading
+import tracemalloc
+import collections
+
+# Threads started by the scanner are named 'scanner...'
+THREAD_PREFIX = 'scanner'
+
+MAX_SECONDS = 600
+DEFAULT_INTERVAL = 0.01
+
+# tracemalloc snapshots kept for diffs
+MAX_SNAPSHOTS = 5
+TRACEMALLOC_FRAMES = 10
+
+_lock = threading.Lock()
+_cpu = None
+_snapshots = collections.OrderedDict()
+_snapshot_seq = 0
+
+def _function_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the scanner threads from a separate thread. Nothing
+    is hooked into the scanner itself, so there is no cost outside a session.
+    """
+    def __init__(self, seconds, interval):
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = collections.Counter()  # stack (root first) -> count
+        self.seconds_by_stack = collections.Counter()  # stack -> wall time between samples
+        self.started = time.time()
+        self.finished = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def run(self):
+        last = time.monotonic()
+        deadline = last + self.seconds
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            now = time.monotonic()
+            elapsed = max(now - last, self.interval)
+            last = now
+            names = {t.ident: t.name for t in threading.enumerate() if t.name.startswith(THREAD_PREFIX)}
+            for ident, frame in sys._current_frames().items():
+                if ident not in names:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_function_key(frame.f_code))
+                    frame = frame.f_back
+                stack = (names[ident],) + tuple(reversed(stack))
+                self.samples[stack] += 1
+                self.seconds_by_stack[stack] += elapsed
+            self.stop_event.wait(self.interval)
+        self.finished = time.time()
+
+    def collapsed(self):
+        """Collapsed stacks ('thread;file:func;... count'), the input format of flamegraph tools."""
+        lines = []
+        for stack, count in self.samples.most_common():
+            frames = [stack[0]] + [f"{filename.rsplit('/', 1)[-1]}:{name}" for filename, _, name in stack[1:]]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def create_stats(self):
+        """Builds pstats data from the samples. Call counts are sample counts."""
+        stats = {}
+        for stack, count in self.samples.items():
+            seconds = self.seconds_by_stack[stack]
+            stack = stack[1:]
+            if not stack:
+                continue
+            seen = set()
+            for depth, func in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                if func not in seen:
+                    # Recursion counts once towards the cumulative time
+                    ct += seconds
+                    seen.add(func)
+                nc += count
+                cc += count
+                if depth == len(stack) - 1:
+                    tt += seconds
+                if depth:
+                    caller = stack[depth - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + count, c_nc + count, c_tt, c_ct + seconds)
+                stats[func] = (cc, nc, tt, ct, callers)
+        self.stats = stats
+
+    def pstats_dump(self):
+        """The profile in the binary format written by pstats.Stats.dump_stats()."""
+        self.create_stats()
+        return marshal.dumps(self.stats)
+
+    def status(self):
+        return {
+            'running': self.finished is None,
+            'started_at': self.started,
+            'finished_at': self.finished,
+            'seconds': self.seconds,
+            'interval': self.interval,
+            'samples': sum(self.samples.values())
+        }
+
+def top_functions(profile, limit=30):
+    """Text report of the functions with the most samples, like pstats' print_stats()."""
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+# --- Commands ---
+
+def cpu_start(seconds=30, interval=DEFAULT_INTERVAL):
+    global _cpu
+    seconds = min(float(seconds), MAX_SECONDS)
+    interval = max(float(interval), 0.001)
+    with _lock:
+        if _cpu and _cpu.finished is None:
+            return {'success': False, 'error': 'A CPU profile is already running'}
+        _cpu = SamplingProfiler(seconds, interval)
+        _cpu.thread.start()
+    return {'success': True, **_cpu.status()}
+
+def cpu_stop():
+    if not _cpu:
+        return {'success': False, 'error': 'No CPU profile'}
+    _cpu.stop_event.set()
+    _cpu.thread.join()
+    return {'success': True, **_cpu.status()}
+
+def cpu_result(fmt='collapsed', limit=30):
+    if not _cpu:
+        return {'success': False, 'error': 'No CPU profile'}
+    result = {'success': True, **_cpu.status()}
+    if result['running']:
+        return result
+    if fmt == 'pstats':
+        result['pstats'] = base64.b64encode(_cpu.pstats_dump()).decode()
+    elif fmt == 'text':
+        result['text'] = top_functions(_cpu, int(limit))
+    else:
+        result['collapsed'] = _cpu.collapsed()
+    return result
+
+def _format_stats(stats, limit):
+    return [{'location': str(stat.traceback[0]),
+             'size_kb': round(stat.size / 1024, 1),
+             'size_diff_kb': round(getattr(stat, 'size_diff', 0) / 1024, 1),
+             'count': stat.count,
+             'traceback': [str(frame) for frame in stat.traceback]}
+            for stat in stats[:limit]]
+
+def memory_snapshot(limit=20):
+    """Takes a tracemalloc snapshot. The first call starts tracing; allocations before that aren't seen."""
+    global _snapshot_seq
+    with _lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        _snapshot_seq += 1
+        _snapshots[_snapshot_seq] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    current, peak = tracemalloc.get_traced_memory()
+    return {'success': True, 'id': _snapshot_seq, 'tracing_started': started,
+            'traced_kb': round(current / 1024, 1), 'peak_kb': round(peak / 1024, 1),
+            'top': _format_stats(snapshot.statistics('lineno'), int(limit))}
+
+def memory_diff(old=None, new=None, limit=20, group_by='lineno'):
+    """Compares two snapshots (default: the last two) and lists the biggest growth."""
+    ids = list(_snapshots)
+    old = int(old) if old else (ids[-2] if len(ids) > 1 else None)
+    new = int(new) if new else (ids[-1] if ids else None)
+    if old not in _snapshots or new not in _snapshots:
+        return {'success': False, 'error': 'Take two snapshots first', 'snapshots': ids}
+    group_by = group_by if group_by in ('lineno', 'traceback', 'filename') else 'lineno'
+    stats = _snapshots[new].compare_to(_snapshots[old], group_by)
+    return {'success': True, 'old': old, 'new': new, 'top': _format_stats(stats, int(limit))}
+
+def memory_stop():
+    with _lock:
+        _snapshots.clear()
+        was_tracing = tracemalloc.is_tracing()
+        tracemalloc.stop()
+    return {'success': True, 'was_tracing': was_tracing}
+
+COMMANDS = {
+    'cpu_start': cpu_start,
+    'cpu_stop': cpu_stop,
+    'cpu_result': cpu_result,
+    'memory_snapshot': memory_snapshot,
+    'memory_diff': memory_diff,
+    'memory_stop': memory_stop,
+}
+
+def handle(action, options=None):
+    if action not in COMMANDS:
+        return {'success': False, 'error': f"Unknown profiling action: {action}"}
+    try:
+        return COMMANDS[action](**(options or {}))
+    except (TypeError, ValueError) as e:
+        return {'success': False, 'error': f"Invalid options: {e}"}
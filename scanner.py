@@ -5,7 +5,19 @@ import datetime
 import requests
 import json
 import threading
-from plexapi.server import PlexServer
+import collections
+import math
+import signal
+import mmap
+import hashlib
+import uuid
+from plex_events import PlexEventListener
+import plex_clients
+import preflight
+import timeseries
+import estimator
+import budget
+import profiler
 
 # Global Control Flags
 stop_event = threading.Event()
@@ -14,6 +26,20 @@ restart_event = threading.Event()
 CONFIG_PATH = '/config/settings.json'
 DB_PATH = '/config/history.db'
 
+# 'embedded' runs the scan loop as a thread of the web process. 'external' means
+# it runs as its own process (`python scanner.py`) and the web tier talks to it
+# through history.db.
+SCANNER_MODE = os.getenv('SCANNER_MODE', 'embedded')
+
+# Published state older than this means the scanner process is gone
+STATE_STALE_AFTER = 30
+
+# Name used for the server configured on the settings page
+DEFAULT_SERVER = 'default'
+
+# Guards counters in `state` that several scan workers update at once
+state_lock = threading.Lock()
+
 state = {
     'status': 'Idle',
     'current_file': '',
@@ -25,12 +51,22 @@ state = {
     'failed': 0,
     'passed': 0,
     'skipped': 0,
+    'reused': 0,
+    'preflight_failed': 0,
+    'predicted': 0,
+    'reverified': 0,
     'subtitle_stats': {},
     'ignored_subtitle_stats': {},
     'audio_stats': {},
     'audio_stats_unexpected': {},
     'failures': [],
-    'last_scan_time': None
+    'breaker_open': False,
+    'eta_seconds': None,
+    'items_per_sec': 0.0,
+    'forecast': None,
+    'transcode_usage': {'bytes': 0, 'seconds': 0},
+    'last_scan_time': None,
+    'servers': {}
 }
 
 def load_settings():
@@ -39,17 +75,24 @@ def load_settings():
             return json.load(f)
     return {}
 
+def connect_db():
+    return sqlite3.connect(DB_PATH, timeout=30)
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
+    # WAL lets scan workers write while others read
+    c.execute("PRAGMA journal_mode=WAL")
     c.execute('''CREATE TABLE IF NOT EXISTS file_checks (
-                    file_path TEXT PRIMARY KEY,
+                    server TEXT NOT NULL DEFAULT 'default',
+                    file_path TEXT NOT NULL,
                     file_size INTEGER,
                     mtime REAL,
                     last_checked TIMESTAMP,
                     status TEXT,
                     audio_status TEXT DEFAULT 'OK',
-                    library_name TEXT
+                    library_name TEXT,
+                    PRIMARY KEY (server, file_path)
                 )''')
     # Add audio_status column to existing tables (backward compatibility)
     try:
@@ -63,6 +106,58 @@ def init_db():
     except:
         pass  # Column already exists
     
+    # Older databases are keyed by file_path only. Rebuild them keyed by
+    # server + path, assigning existing rows to the default server.
+    columns = [r[1] for r in c.execute("PRAGMA table_info(file_checks)")]
+    if 'server' not in columns:
+        c.execute("ALTER TABLE file_checks RENAME TO file_checks_old")
+        c.execute('''CREATE TABLE file_checks (
+                        server TEXT NOT NULL DEFAULT 'default',
+                        file_path TEXT NOT NULL,
+                        file_size INTEGER,
+                        mtime REAL,
+                        last_checked TIMESTAMP,
+                        status TEXT,
+                        audio_status TEXT DEFAULT 'OK',
+                        library_name TEXT,
+                        PRIMARY KEY (server, file_path)
+                    )''')
+        c.execute('''INSERT INTO file_checks (server, file_path, file_size, mtime, last_checked, status, audio_status, library_name)
+                     SELECT ?, file_path, file_size, mtime, last_checked, status, audio_status, library_name FROM file_checks_old''',
+                  (DEFAULT_SERVER,))
+        c.execute("DROP TABLE file_checks_old")
+    
+    # Add content_id column to existing tables (backward compatibility)
+    try:
+        c.execute("ALTER TABLE file_checks ADD COLUMN content_id TEXT")
+    except:
+        pass  # Column already exists
+    c.execute("CREATE INDEX IF NOT EXISTS idx_file_checks_content ON file_checks (content_id)")
+    
+    # Add pre-flight and failure-signature columns to existing tables (backward compatibility)
+    for column in ("preflight_status TEXT", "preflight_reason TEXT", "preflight_ms REAL", "signature TEXT", "verdict_source TEXT", "rating_key TEXT",
+                   "failed_offsets TEXT"):
+        try:
+            c.execute(f"ALTER TABLE file_checks ADD COLUMN {column}")
+        except:
+            pass  # Column already exists
+    
+    # Channel between a standalone scanner process and the web workers
+    c.execute('''CREATE TABLE IF NOT EXISTS scanner_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    pid INTEGER,
+                    updated_at REAL,
+                    state TEXT
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS scanner_control (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    command TEXT,
+                    payload TEXT,
+                    created_at REAL,
+                    handled_at REAL,
+                    result TEXT
+                )''')
+    
     c.execute('''CREATE TABLE IF NOT EXISTS scan_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     timestamp TEXT,
@@ -72,6 +167,58 @@ def init_db():
                     failed INTEGER,
                     skipped INTEGER
                 )''')
+
+    # Last seen Plex version per server; a change triggers extra re-verification
+    c.execute('''CREATE TABLE IF NOT EXISTS plex_versions (
+                    server TEXT PRIMARY KEY,
+                    version TEXT,
+                    changed_at REAL
+                )''')
+
+    # When each library was last scanned completely, for per-library schedules
+    c.execute('''CREATE TABLE IF NOT EXISTS library_schedule (
+                    server TEXT,
+                    library TEXT,
+                    last_run REAL,
+                    PRIMARY KEY (server, library)
+                )''')
+
+    # On-demand scans requested through /api/scan, and their per-file results
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id TEXT PRIMARY KEY,
+                    server TEXT,
+                    request TEXT,
+                    status TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    total INTEGER,
+                    error TEXT
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_job_results (
+                    job_id TEXT,
+                    file_path TEXT,
+                    title TEXT,
+                    status TEXT,
+                    reason TEXT,
+                    checked_at REAL,
+                    PRIMARY KEY (job_id, file_path)
+                )''')
+
+    # Throughput samples, rolled up from raw to hourly to daily as they age (see timeseries.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_samples (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL,
+                    resolution TEXT,
+                    kind TEXT,
+                    duration REAL,
+                    items INTEGER,
+                    probes INTEGER,
+                    probe_seconds REAL,
+                    failures INTEGER,
+                    bytes_read INTEGER
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scan_samples_ts ON scan_samples (kind, ts)")
     conn.commit()
     return conn
 
@@ -93,7 +240,7 @@ def save_scan_history(conn, libraries, stats):
 
 def get_recent_history():
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = connect_db()
         c = conn.cursor()
         c.execute("SELECT timestamp, libraries, scanned, passed, failed, skipped FROM scan_history ORDER BY id DESC LIMIT 10")
         rows = c.fetchall()
@@ -113,7 +260,56 @@ def get_recent_history():
     except:
         return []
 
-def get_file_fingerprint(item, part):
+EXPORT_COLUMNS = ['server', 'library_name', 'file_path', 'file_size', 'mtime', 'last_checked', 'status', 'audio_status',
+                  'verdict_source', 'signature', 'preflight_status', 'preflight_reason', 'content_id', 'rating_key']
+
+def iter_file_checks(filters, batch_size=1000):
+    """
+    Yields file_checks rows as tuples in EXPORT_COLUMNS order, fetched from the
+    cursor in batches so memory use doesn't grow with the size of the table.
+    filters: optional 'server', 'status', 'audio_status', 'library' (lists of values),
+    'since' and 'until' (ISO timestamps, compared against last_checked).
+    """
+    where = []
+    params = []
+    for key, column in (('server', 'server'), ('status', 'status'), ('audio_status', 'audio_status'), ('library', 'library_name')):
+        values = filters.get(key)
+        if values:
+            where.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    # last_checked is stored as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    if filters.get('since'):
+        where.append("last_checked >= ?")
+        params.append(filters['since'].replace('T', ' '))
+    if filters.get('until'):
+        where.append("last_checked < ?")
+        params.append(filters['until'].replace('T', ' '))
+
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM file_checks"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY server, file_path"
+
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        c.execute(query, params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def get_history_series(since, until, resolution, kind=timeseries.INTERVAL):
+    conn = connect_db()
+    try:
+        return timeseries.get_series(conn, since, until, resolution, kind)
+    finally:
+        conn.close()
+
+def get_file_fingerprint(item, part, server=DEFAULT_SERVER):
     # Base mtime from the file part
     part_mtime = float(getattr(part, 'updatedAt', 0) or 0)
     
@@ -123,15 +319,125 @@ def get_file_fingerprint(item, part):
         added_at = float(item.addedAt.timestamp())
         
     return {
+        'server': server,
+        'rating_key': str(item.ratingKey),
         'path': part.file,
         'size': part.size,
         # Combining these ensures re-imports generate a new DB fingerprint
         'mtime': part_mtime + added_at 
     }
 
+def local_path_for(settings, plex_path):
+    """
+    Translates a path as Plex sees it into a path inside this container using
+    the optional `path_mappings` setting. Returns None if the file isn't mounted.
+    """
+    if not plex_path:
+        return None
+    path = plex_path
+    for plex_prefix, local_prefix in settings.get('path_mappings', {}).items():
+        if plex_path.startswith(plex_prefix):
+            path = local_prefix + plex_path[len(plex_prefix):]
+            break
+    return path if os.path.isfile(path) else None
+
+# Bytes hashed at the start, middle and end of a file for its content identity
+IDENTITY_SAMPLE_SIZE = 1024 * 1024
+
+def get_content_identity(path):
+    """
+    Identifies a file by its size plus a hash of sampled head/middle/tail
+    blocks, read through mmap. Hardlinks and copies of the same file get the
+    same identity regardless of path or library.
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return None
+            digest = hashlib.blake2b(digest_size=16)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if size <= 3 * IDENTITY_SAMPLE_SIZE:
+                    digest.update(mm[:])
+                else:
+                    middle = (size - IDENTITY_SAMPLE_SIZE) // 2
+                    for offset in (0, middle, size - IDENTITY_SAMPLE_SIZE):
+                        digest.update(mm[offset:offset + IDENTITY_SAMPLE_SIZE])
+            return f"{size}:{digest.hexdigest()}"
+    except (OSError, ValueError) as e:
+        print(f"   [IDENTITY] Could not read {path}: {e}")
+        return None
+
+def language_settings(settings, library_name):
+    """The subtitle and audio languages a library is tested against."""
+    return (set(expand_languages(get_library_setting(settings, library_name, 'target_languages', 'en, eng'))),
+            set(expand_languages(get_library_setting(settings, library_name, 'target_audio_languages', ''))))
+
+def find_reusable_result(conn, fingerprint, max_age_days, settings, library_name):
+    """
+    Returns (file_path, status, audio_status) of a recent transcode-verified
+    result for the same content elsewhere on the same server. Other servers may
+    run another Plex version, and subtitle and audio checks depend on the
+    library's languages, so only libraries with the same ones count.
+    """
+    if not fingerprint.get('content_id'):
+        return None
+    since = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    languages = language_settings(settings, library_name)
+    c = conn.cursor()
+    c.execute('''SELECT file_path, status, audio_status, library_name FROM file_checks
+                 WHERE content_id=? AND status IN ('PASS', 'FAIL') AND verdict_source='probe' AND last_checked >= ?
+                   AND server=? AND file_path != ?
+                 ORDER BY last_checked DESC''',
+              (fingerprint['content_id'], since, fingerprint['server'], fingerprint['path']))
+    for file_path, status, audio_status, other_library in c.fetchall():
+        if other_library == library_name or language_settings(settings, other_library) == languages:
+            return file_path, status, audio_status
+    return None
+
+def get_stream_signature(part, target_languages):
+    """
+    Describes the traits of a part that commonly break the transcoder: video
+    codec/profile, Dolby Vision profile, scan type and the codecs of the
+    subtitles that will be burned in. Needs a reloaded item (streams loaded).
+    """
+    videos = part.videoStreams()
+    if not videos:
+        return None
+    video = videos[0]
+    fields = [
+        getattr(video, 'codec', None) or 'unknown',
+        getattr(video, 'profile', None) or '-',
+        f"DV{video.DOVIProfile}" if getattr(video, 'DOVIPresent', False) else 'noDV',
+        getattr(video, 'scanType', None) or 'progressive'
+    ]
+    sub_codecs = sorted({s.codec for s in part.subtitleStreams()
+                         if s.codec and (s.languageCode or 'unknown') in target_languages})
+    fields.append('subs:' + (','.join(sub_codecs) or 'none'))
+    return ' '.join(str(f) for f in fields)
+
+def load_failing_signatures(conn, server, min_samples):
+    """Signatures whose every transcode-verified file on this server failed."""
+    c = conn.cursor()
+    c.execute('''SELECT signature FROM file_checks
+                 WHERE server=? AND signature IS NOT NULL AND verdict_source='probe'
+                 GROUP BY signature
+                 HAVING COUNT(*) >= ? AND SUM(status='FAIL') = COUNT(*)''',
+              (server, min_samples))
+    return {r[0]: 0 for r in c.fetchall()}
+
+def find_part(item, part_id):
+    """Finds a part by id, e.g. in an item that has been reloaded since the part was read."""
+    for media in item.media:
+        for part in media.parts:
+            if part.id == part_id:
+                return part
+    return None
+
 def should_skip(conn, fingerprint):
     c = conn.cursor()
-    c.execute("SELECT file_size, mtime, status, audio_status FROM file_checks WHERE file_path=?", (fingerprint['path'],))
+    c.execute("SELECT file_size, mtime, status, audio_status FROM file_checks WHERE server=? AND file_path=?",
+              (fingerprint['server'], fingerprint['path']))
     row = c.fetchone()
     if row:
         stored_size, stored_mtime, status, audio_status = row
@@ -139,35 +445,87 @@ def should_skip(conn, fingerprint):
             return True
     return False
 
-def update_db(conn, fingerprint, status, audio_status='OK', library_name=None):
+def update_db(conn, fingerprint, status, audio_status='OK', library_name=None, verdict_source='probe'):
+    """
+    Stores the verdict for a file. verdict_source records how it was reached:
+    'probe' (Plex transcode), 'reused', 'preflight' or 'predicted'.
+    """
+    check = fingerprint.get('preflight') or {}
     c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO file_checks (file_path, file_size, mtime, last_checked, status, audio_status, library_name)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-                 (fingerprint['path'], fingerprint['size'], fingerprint['mtime'], datetime.datetime.now(), status, audio_status, library_name))
+    c.execute('''INSERT OR REPLACE INTO file_checks (server, file_path, file_size, mtime, last_checked, status, audio_status, library_name, content_id,
+                                                     preflight_status, preflight_reason, preflight_ms, signature, verdict_source, rating_key,
+                                                     failed_offsets)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+                 (fingerprint['server'], fingerprint['path'], fingerprint['size'], fingerprint['mtime'], datetime.datetime.now(), status, audio_status, library_name,
+                  fingerprint.get('content_id'), check.get('status'), check.get('reason'), check.get('ms'),
+                  fingerprint.get('signature'), verdict_source, fingerprint.get('rating_key'),
+                  fingerprint.get('failed_offsets')))
     conn.commit()
 
-def verify_stream(media_item, subtitle_stream=None):
+PROBE_BYTES = 10 * 1024 * 1024
+
+def verify_stream(media_item, subtitle_stream=None, transcode_budget=None, media_index=0, part_index=0,
+                  offset=0, max_bytes=PROBE_BYTES):
+    """
+    Asks Plex to transcode a part of an item and reads `max_bytes` of the stream,
+    starting `offset` seconds in. media_index/part_index pick the version and
+    file, the default is the item's first.
+    """
     params = {
         'videoResolution': '720x480',
         'maxVideoBitrate': 2000,
-        'quality': 5
+        'quality': 5,
+        'mediaIndex': media_index,
+        'partIndex': part_index,
+        'offset': int(offset)
     }
     if subtitle_stream:
         params['subtitleStreamID'] = subtitle_stream.id
         params['subtitles'] = 'burn' 
 
+    started = time.perf_counter()
+    bytes_read = 0
     try:
         url = media_item.getStreamURL(**params)
         with requests.get(url, stream=True, timeout=15) as r:
             if r.status_code == 200:
-                bytes_read = 0
-                for chunk in r.iter_content(chunk_size=1024*1024):
+                for chunk in r.iter_content(chunk_size=min(max_bytes, 1024*1024)):
                     bytes_read += len(chunk)
-                    if bytes_read >= 10 * 1024 * 1024:
+                    if bytes_read >= max_bytes:
                         return True
             return False
     except:
         return False
+    finally:
+        elapsed = time.perf_counter() - started
+        timeseries.record_probe(elapsed, bytes_read)
+        if transcode_budget:
+            transcode_budget.charge(bytes_read, elapsed)
+
+def probe_video(ctx, item, part, media_index, part_index):
+    """
+    Tests a part's video. With `"probe_mode": "sampled"`, short windows of
+    `probe_window_bytes` are transcoded at each of `probe_offsets` (percent of the
+    duration) instead of one long read from the start.
+    Returns (success, failed offsets, seconds spent waiting for the budget).
+    """
+    settings = ctx['settings']
+    duration = getattr(part, 'duration', None) or getattr(item, 'duration', None)
+    if settings.get('probe_mode', 'start') != 'sampled' or not duration:
+        waited = wait_for_budget(ctx)
+        success = verify_stream(item, transcode_budget=ctx['budget'], media_index=media_index, part_index=part_index)
+        return success, [], waited
+
+    window_bytes = int(settings.get('probe_window_bytes', 2 * 1024 * 1024))
+    waited = 0
+    failed = []
+    for percent in settings.get('probe_offsets', [10, 50, 90]):
+        waited += wait_for_budget(ctx)
+        # Plex durations are in milliseconds, the offset is in seconds
+        if not verify_stream(item, transcode_budget=ctx['budget'], media_index=media_index, part_index=part_index,
+                             offset=duration / 1000 * percent / 100, max_bytes=window_bytes):
+            failed.append(percent)
+    return not failed, failed, waited
 
 def send_canary_alert(settings, title, status_type, message, detail_field=None):
     """
@@ -261,6 +619,11 @@ def send_discord_report(settings, stats, failures, is_recovery=False):
     elif stats['failed'] > 0:
         color = 0xFF9900 
 
+    usage_text = ""
+    usage = stats.get('transcode_usage')
+    if usage and usage['bytes']:
+        usage_text = f"\n**Transcoded:** {usage['bytes'] / 1024**3:.2f} GB in {datetime.timedelta(seconds=int(usage['seconds']))}"
+
     sub_text = ""
     if stats['subtitle_stats']:
         sub_text = "\n\n**Subtitles Checked:**\n" + "\n".join([f"• {k}: {v}" for k,v in stats['subtitle_stats'].items()])
@@ -270,6 +633,7 @@ def send_discord_report(settings, stats, failures, is_recovery=False):
         f"**Passed:** {stats['passed']}\n"
         f"**Failed:** {stats['failed']} " + (f"(All previously reported)" if stats['failed'] > 0 and not failures else "") + "\n"
         f"**Skipped:** {stats['skipped']}"
+        f"{usage_text}"
         f"{sub_text}"
     )
 
@@ -354,6 +718,1408 @@ def get_library_setting(settings, library_name, setting_key, default_value):
     # Fall back to global setting
     return settings.get(setting_key, default_value)
 
+# Global language expansion map
+EXPANSION_MAP = {
+    'en': ['en', 'eng'],
+    'no': ['no', 'nor', 'nob', 'nno'],
+    'sv': ['sv', 'swe'],
+    'da': ['da', 'dan'],
+    'de': ['de', 'ger', 'deu'],
+    'fr': ['fr', 'fre', 'fra'],
+    'es': ['es', 'spa'],
+    'it': ['it', 'ita'],
+    'ja': ['ja', 'jpn'],
+    'zh': ['zh', 'chi', 'zho']
+}
+
+def expand_languages(lang_setting):
+    """Turns a comma-separated language setting into a list including all known aliases."""
+    user_langs = [x.strip().lower() for x in lang_setting.split(',') if x.strip()]
+    languages = set(user_langs)
+    for code in user_langs:
+        if code in EXPANSION_MAP:
+            languages.update(EXPANSION_MAP[code])
+    return list(languages)
+
+def get_display_title(item):
+    if item.type == 'episode':
+        return f"{item.grandparentTitle} - {item.seasonEpisode} - {item.title}"
+    elif item.type == 'movie':
+        return f"{item.title} ({item.year})"
+    return item.title
+
+def get_servers(settings):
+    """
+    Returns the Plex servers to scan. The server from the settings page is
+    named 'default'; additional servers can be listed under `servers` in settings.json.
+    """
+    default_concurrency = int(settings.get('scan_concurrency', 1))
+    default_throttle = float(settings.get('scan_throttle', 1))
+
+    servers = []
+    if settings.get('plex_url') and settings.get('plex_token'):
+        servers.append({
+            'name': DEFAULT_SERVER,
+            'plex_url': settings['plex_url'],
+            'plex_token': settings['plex_token'],
+            'libraries': settings.get('libraries', []),
+            'canary_files': settings.get('canary_files', []),
+            'concurrency': max(1, default_concurrency),
+            'throttle': default_throttle,
+            'budget': settings.get('transcode_budget') or {}
+        })
+
+    for idx, entry in enumerate(settings.get('servers', [])):
+        name = entry.get('name') or f"server{idx + 1}"
+        if not entry.get('plex_url') or not entry.get('plex_token'):
+            print(f"Skipping server '{name}': plex_url and plex_token are required")
+            continue
+        if any(s['name'] == name for s in servers):
+            print(f"Skipping server '{name}': duplicate server name")
+            continue
+        servers.append({
+            'name': name,
+            'plex_url': entry['plex_url'],
+            'plex_token': entry['plex_token'],
+            'libraries': entry.get('libraries', []),
+            'canary_files': entry.get('canary_files', []),
+            'concurrency': max(1, int(entry.get('concurrency', default_concurrency))),
+            'throttle': float(entry.get('throttle', default_throttle)),
+            'budget': entry.get('transcode_budget', settings.get('transcode_budget')) or {}
+        })
+    return servers
+
+def new_server_state():
+    return {
+        'status': 'Idle',
+        'current_file': '',
+        'current_activity': '',
+        'current_library': '',
+        'progress': 0,
+        'total_items': 0,
+        'processed': 0,
+        'scanned': 0,
+        'passed': 0,
+        'failed': 0,
+        'skipped': 0,
+        'reused': 0,
+        'preflight_failed': 0,
+        'predicted': 0,
+        'reverified': 0,
+        'breaker': None,
+        'eta_seconds': None,
+        'items_per_sec': 0.0,
+        'forecast': None,
+        'budget': None
+    }
+
+def reset_scan_stats(servers):
+    state['scanned'] = 0
+    state['skipped'] = 0
+    state['reused'] = 0
+    state['preflight_failed'] = 0
+    state['predicted'] = 0
+    state['reverified'] = 0
+    state['failed'] = 0
+    state['passed'] = 0
+    state['total_items'] = 0
+    state['progress'] = 0
+    state['failures'] = []
+    state['breaker_open'] = False
+    state['eta_seconds'] = None
+    state['items_per_sec'] = 0.0
+    state['forecast'] = None
+    state['transcode_usage'] = {'bytes': 0, 'seconds': 0}
+    state['subtitle_stats'] = {}
+    state['ignored_subtitle_stats'] = {}
+    state['audio_stats'] = {}
+    state['audio_stats_unexpected'] = {}
+    state['current_library'] = ''
+    state['servers'] = {s['name']: new_server_state() for s in servers}
+
+def bump(ctx, key, amount=1):
+    """Adds to a scan counter for the context's server and the overall totals."""
+    with state_lock:
+        state[key] += amount
+        state['servers'][ctx['server']['name']][key] += amount
+
+def bump_stat(stat_name, key):
+    with state_lock:
+        state[stat_name][key] = state[stat_name].get(key, 0) + 1
+
+def set_activity(ctx, **fields):
+    """Updates what is being scanned, both overall and for the context's server."""
+    server_state = state['servers'][ctx['server']['name']]
+    for key, value in fields.items():
+        state[key] = value
+        server_state[key] = value
+
+def mark_processed(ctx):
+    timeseries.record_item()
+    with state_lock:
+        server_state = state['servers'][ctx['server']['name']]
+        server_state['processed'] += 1
+        server_state['progress'] = int((server_state['processed'] / max(1, server_state['total_items'])) * 100)
+        processed = sum(s['processed'] for s in state['servers'].values())
+        state['progress'] = int((processed / max(1, state['total_items'])) * 100)
+        server_state['eta_seconds'] = ctx['estimator'].eta()
+        server_state['items_per_sec'] = ctx['estimator'].items_per_sec()
+        # Servers scan in parallel, so the slowest one decides when the scan ends
+        state['eta_seconds'] = max(s['eta_seconds'] or 0 for s in state['servers'].values())
+        state['items_per_sec'] = round(sum(s['items_per_sec'] for s in state['servers'].values()), 2)
+        server_state['budget'] = ctx['budget'].snapshot()
+        budgets = [s['budget'] for s in state['servers'].values() if s['budget']]
+        state['transcode_usage'] = {'bytes': sum(b['bytes_used'] for b in budgets),
+                                    'seconds': round(sum(b['seconds_used'] for b in budgets), 1)}
+
+# Per-server cost estimates, kept between scans
+_estimators = {}
+
+# Per-server transcode budgets. They outlive a scan so a new cycle can't start with a full bucket.
+_budgets = {}
+
+def get_budget(server):
+    config = json.dumps(server['budget'], sort_keys=True)
+    entry = _budgets.get(server['name'])
+    if not entry or entry[0] != config:
+        entry = _budgets[server['name']] = (config, budget.TranscodeBudget(server['budget']))
+    return entry[1]
+
+def wait_for_budget(ctx):
+    """Blocks until the server's transcode budget allows another test. Returns the seconds waited."""
+    server_state = state['servers'][ctx['server']['name']]
+    started = time.time()
+    while not restart_event.is_set() and not stop_event.is_set():
+        wait, reason = ctx['budget'].wait_time()
+        if wait <= 0:
+            break
+        if server_state['status'] != 'Waiting for budget':
+            print(f"   [BUDGET] {ctx['server']['name']}: {reason} limit reached, waiting {int(wait)}s")
+            server_state['status'] = 'Waiting for budget'
+        server_state['budget'] = ctx['budget'].snapshot()
+        time.sleep(min(wait, 5))
+    if server_state['status'] == 'Waiting for budget':
+        server_state['status'] = 'Scanning'
+    return time.time() - started
+
+def new_scan_context(settings, server, plex=None):
+    """Per-run bookkeeping for one server, shared by the full scan and event batches."""
+    canary_file = server.get('canary_files', [])
+    return {
+        'settings': settings,
+        'server': server,
+        'plex': plex,
+        'listener': None,
+        'throttle': server['throttle'],
+        'canary_file': canary_file,
+        'canary_ids': [str(x['id']) for x in canary_file],
+        'found_canary_ids': set(),
+        'new_discord_failures': [],
+        'error': None,
+        'breaker': None,
+        'estimator': _estimators.setdefault(server['name'], estimator.ScanEstimator()),
+        'budget': get_budget(server),
+        'reverify': set(),
+        'libraries': server['libraries']
+    }
+
+def record_result(conn, ctx, result):
+    """Stores a verdict, updates the counters and sends the alerts that go with it."""
+    settings = ctx['settings']
+    display_title = result['title']
+    reason = result['reason']
+    is_canary = result['is_canary']
+    file_changed = result['file_changed']
+    previous_status = result['previous_status']
+
+    status = 'PASS' if result['success'] else 'FAIL'
+    update_db(conn, result['fingerprint'], status, result['audio_status'], result['library_name'], result['verdict_source'])
+    if result.get('job'):
+        record_job_result(conn, result['job'], result['file'], display_title, status, None if result['success'] else reason)
+
+    if result['success']:
+        bump(ctx, 'passed')
+        if is_canary:
+            if file_changed:
+                send_canary_alert(settings, display_title, "CHANGED", "The file was updated and PASSED the scan.")
+            elif previous_status == 'FAIL':
+                send_canary_alert(settings, display_title, "RECOVERED", "The file failed previously but is now playable.")
+    else:
+        bump(ctx, 'failed')
+        timeseries.record_failure()
+        failure_data = {'title': display_title, 'file': os.path.basename(result['file']), 'reason': reason,
+                        'server': ctx['server']['name'], 'predicted': result['predicted']}
+        with state_lock:
+            state['failures'].append(failure_data)
+        
+        is_new_failure = (previous_status != 'FAIL' or file_changed)
+        
+        if is_canary:
+            if file_changed:
+                send_canary_alert(settings, display_title, "CHANGED", f"The file was updated and FAILED the scan.\nReason: {reason}")
+            elif is_new_failure:
+                send_canary_alert(settings, display_title, "OUTAGE", reason)
+                print(f"   [CANARY FILE FAIL] {display_title} (New)")
+            else:
+                print(f"   [CANARY FILE FAIL] {display_title} (Known)")
+        else:
+            if is_new_failure:
+                if settings.get('notify_immediate', False):
+                    send_immediate_alert(settings, failure_data)
+                ctx['new_discord_failures'].append(failure_data)
+                print(f"   [FAIL] {display_title} (New)")
+            else:
+                print(f"   [FAIL] {display_title} (Known)")
+
+def process_item(conn, ctx, lib_name, item, force=False, job=None):
+    """
+    Verifies every part of a Plex item and records the results.
+    `force` bypasses the PASS cache, e.g. for items Plex reported with a changed file.
+    `job` is the id of the /api/scan job the item belongs to, if any.
+    """
+    settings = ctx['settings']
+    server_name = ctx['server']['name']
+    notify_audio_mismatch = settings.get('notify_audio_mismatch', False)
+    content_dedupe = settings.get('content_dedupe', False)
+    run_preflight = settings.get('preflight', False)
+    predict_failures = settings.get('predict_failures', False)
+    reverify_every = max(1, int(settings.get('signature_reverify_every', 20)))
+    # Re-verification spreads its picks over signatures, so they're needed then too
+    track_signatures = predict_failures or reverify_enabled(settings)
+    reloaded = False
+    preflight_short_circuit = settings.get('preflight_short_circuit', True)
+
+    display_title = get_display_title(item)
+    set_activity(ctx, current_file=display_title, current_library=lib_name)
+
+    # Get per-library language settings
+    target_languages = expand_languages(get_library_setting(settings, lib_name, 'target_languages', 'en, eng'))
+    target_audio_languages = expand_languages(get_library_setting(settings, lib_name, 'target_audio_languages', ''))
+
+    for media_index, media in enumerate(item.media):
+        for part_index, part in enumerate(media.parts):
+            part_started = time.perf_counter()
+            subtitle_seconds = 0
+            waited = 0
+            subtitle_tests = 0
+            fingerprint = get_file_fingerprint(item, part, server_name)
+            
+            # Canary file Check
+            is_canary = str(item.ratingKey) in ctx['canary_ids']
+            file_changed = False
+            
+            c = conn.cursor()
+            c.execute("SELECT file_size, mtime, status, audio_status FROM file_checks WHERE server=? AND file_path=?",
+                      (server_name, fingerprint['path']))
+            row = c.fetchone()
+            previous_status = row[2] if row else None
+            previous_audio_status = row[3] if row else 'OK'
+            
+            # Check for file changes for ALL files, not just canaries
+            if row:
+                stored_size, stored_mtime, status, audio_status_old = row
+                if stored_size != fingerprint['size'] or stored_mtime != fingerprint['mtime']:
+                    file_changed = True
+            
+            if is_canary:
+                ctx['found_canary_ids'].add(str(item.ratingKey))
+                print(f"   [CANARY] Forcing scan on {display_title}")
+                if file_changed:
+                    print(f"   [CANARY] File changed detected for {display_title}")
+
+            reverify = fingerprint['path'] in ctx['reverify']
+            if reverify:
+                print(f"   [RE-VERIFY] Re-testing {display_title}")
+                bump(ctx, 'reverified')
+            # Forced, re-verified and job files need a fresh transcode, not a reused or predicted verdict
+            needs_transcode = force or reverify or bool(job)
+            if not is_canary and not needs_transcode and should_skip(conn, fingerprint):
+                bump(ctx, 'skipped')
+                ctx['estimator'].record('skip', time.perf_counter() - part_started)
+                continue
+
+            local_path = local_path_for(settings, part.file) if (run_preflight or content_dedupe) else None
+
+            # Cheap local header check before spending any Plex transcoder time
+            check = None
+            if run_preflight and local_path:
+                check = preflight.check_file(local_path)
+                fingerprint['preflight'] = check
+                if check['status'] in (preflight.WARN, preflight.FAIL):
+                    print(f"   [PRE-FLIGHT {check['status']}] {display_title}: {check['reason']} ({check['ms']} ms)")
+            # Job items were asked for explicitly, so the pre-flight result is only recorded
+            hopeless = bool(check and check['status'] == preflight.FAIL and preflight_short_circuit
+                            and not is_canary and not job)
+
+            # The same content may already have a verdict from another library or hardlink
+            reused = None
+            if content_dedupe and local_path and not hopeless:
+                fingerprint['content_id'] = get_content_identity(local_path)
+                if not is_canary and not needs_transcode:
+                    reused = find_reusable_result(conn, fingerprint, int(settings.get('content_reuse_days', 7)), settings, lib_name)
+            
+            # Files matching a signature that has always failed are classified without a transcode,
+            # except for every Nth match which is verified to confirm the rule still holds
+            predicted = False
+            if track_signatures and not hopeless and not reused:
+                if not reloaded:
+                    item.reload()
+                    reloaded = True
+                full_part = find_part(item, part.id) or part
+                fingerprint['signature'] = get_stream_signature(full_part, target_languages)
+                signature = fingerprint['signature']
+                failing = ctx.get('failing_signatures', {})
+                if signature in failing and not is_canary and not needs_transcode:
+                    predicted = failing[signature] % reverify_every != 0
+                    failing[signature] += 1
+                    if not predicted:
+                        print(f"   [SIGNATURE] Re-verifying rule '{signature}' with {display_title}")
+
+            probed = False
+            if hopeless:
+                bump(ctx, 'preflight_failed')
+                success = False
+                reason = f"Pre-flight: {check['reason']}"
+                audio_status = 'OK'
+            elif reused:
+                bump(ctx, 'reused')
+                reused_path, reused_status, audio_status = reused
+                audio_status = audio_status or 'OK'
+                success = reused_status == 'PASS'
+                reason = f"Same content as {os.path.basename(reused_path)} (failed)"
+                print(f"   [REUSED] {display_title}: {reused_status} from {reused_path}")
+            elif predicted:
+                bump(ctx, 'predicted')
+                success = False
+                reason = f"Predicted FAIL: {fingerprint['signature']}"
+                audio_status = 'OK'
+            else:
+                probed = True
+                bump(ctx, 'scanned')
+                set_activity(ctx, current_activity="Video Stream")
+                
+                success, failed_offsets, probe_waited = probe_video(ctx, item, part, media_index, part_index)
+                waited += probe_waited
+                reason = "Video Transcode Failed"
+                if failed_offsets:
+                    fingerprint['failed_offsets'] = ",".join(str(o) for o in failed_offsets)
+                    reason += " at " + ", ".join(f"{o}%" for o in failed_offsets)
+                audio_status = 'OK'
+
+            if probed and fingerprint.get('signature') in ctx.get('failing_signatures', {}) and success:
+                # A known-bad signature just played, so the rule no longer holds
+                print(f"   [SIGNATURE] Rule '{fingerprint['signature']}' disproved by {display_title}")
+                ctx['failing_signatures'].pop(fingerprint['signature'], None)
+
+            if success and probed:
+                if not reloaded:
+                    item.reload()
+                    reloaded = True
+                # Streams of this part only; the item's other versions have their own
+                full_part = find_part(item, part.id) or part
+                
+                # Check audio language if configured
+                if target_audio_languages:
+                    audio_streams = full_part.audioStreams()
+                    found_audio_langs = set()
+                    for audio in audio_streams:
+                        audio_lang = audio.languageCode or 'unknown'
+                        found_audio_langs.add(audio_lang)
+                    
+                    # Track expected vs unexpected audio languages
+                    for audio_lang in found_audio_langs:
+                        if audio_lang in target_audio_languages:
+                            bump_stat('audio_stats', audio_lang)
+                        else:
+                            bump_stat('audio_stats_unexpected', audio_lang)
+                    
+                    # Check if we should flag an audio mismatch
+                    if notify_audio_mismatch:
+                        # Check if AT LEAST ONE expected language is present
+                        has_expected = any(lang in target_audio_languages for lang in found_audio_langs)
+                        
+                        # Mismatch ONLY if we found audio AND none of it is expected
+                        if found_audio_langs and not has_expected:
+                            audio_status = 'MISMATCH'
+                            
+                            # Only notify on NEW audio mismatches (not previously detected)
+                            is_new_audio_mismatch = (previous_audio_status != 'MISMATCH')
+                            if is_new_audio_mismatch:
+                                expected_display = [lang for lang in target_audio_languages if lang != 'unknown']
+                                found_display = list(found_audio_langs)
+                                send_ntfy_audio_mismatch(
+                                    settings,
+                                    display_title,
+                                    part.file,
+                                    expected_display or target_audio_languages,
+                                    found_display
+                                )
+                                print(f"   [AUDIO MISMATCH] {display_title} - Expected: {target_audio_languages}, Found: {found_audio_langs}")
+                            else:
+                                print(f"   [AUDIO MISMATCH] {display_title} - Expected: {target_audio_languages}, Found: {found_audio_langs} (Known)")
+                
+                for sub in full_part.subtitleStreams():
+                    lang_code = sub.languageCode or 'unknown'
+                    if lang_code in target_languages:
+                        set_activity(ctx, current_activity=f"Subtitle: {lang_code}")
+                        waited += wait_for_budget(ctx)
+                        subtitle_started = time.perf_counter()
+                        subtitle_ok = verify_stream(item, subtitle_stream=sub, transcode_budget=ctx['budget'],
+                                                    media_index=media_index, part_index=part_index)
+                        subtitle_tests += 1
+                        subtitle_elapsed = time.perf_counter() - subtitle_started
+                        subtitle_seconds += subtitle_elapsed
+                        ctx['estimator'].record_subtitle(subtitle_elapsed)
+                        if not subtitle_ok:
+                            success = False
+                            reason = f"Subtitle Failed: {sub.language}"
+                            break
+                        else:
+                            bump_stat('subtitle_stats', lang_code)
+                    else:
+                        bump_stat('ignored_subtitle_stats', lang_code)
+
+            if hopeless:
+                verdict_source = 'preflight'
+            elif reused:
+                verdict_source = 'reused'
+            elif predicted:
+                verdict_source = 'predicted'
+            else:
+                verdict_source = 'probe'
+
+            result = {
+                'fingerprint': fingerprint,
+                'success': success,
+                'reason': reason,
+                'audio_status': audio_status,
+                'library_name': lib_name,
+                'verdict_source': verdict_source,
+                'title': display_title,
+                'file': part.file,
+                'is_canary': is_canary,
+                'file_changed': file_changed,
+                'previous_status': previous_status,
+                'predicted': predicted,
+                'job': job
+            }
+
+            # Transcode failures go through the circuit breaker, which holds
+            # them back until it is sure the transcoder itself is working
+            breaker = ctx.get('breaker')
+            if breaker and probed and not is_canary:
+                if success:
+                    breaker.release(conn)
+                    record_result(conn, ctx, result)
+                else:
+                    breaker.hold(conn, result, (lib_name, item, force, job))
+            else:
+                record_result(conn, ctx, result)
+
+            ctx['estimator'].record('video' if probed else 'local',
+                                    time.perf_counter() - part_started - subtitle_seconds - waited, subtitle_tests)
+            
+            if probed:
+                time.sleep(ctx['throttle'])
+
+def load_signature_rules(ctx):
+    """Loads the known-bad signatures of the context's server from file_checks history."""
+    settings = ctx['settings']
+    ctx['failing_signatures'] = {}
+    if not settings.get('predict_failures', False):
+        return
+    conn = connect_db()
+    try:
+        ctx['failing_signatures'] = load_failing_signatures(conn, ctx['server']['name'],
+                                                            int(settings.get('signature_min_samples', 5)))
+    finally:
+        conn.close()
+    if ctx['failing_signatures']:
+        print(f"Known failing signatures ({ctx['server']['name']}): {', '.join(ctx['failing_signatures'])}")
+
+# --- CIRCUIT BREAKER ---
+
+class TranscoderBreaker:
+    """
+    Stops a server's scan from marking good files as FAIL while its transcoder is down.
+
+    Transcode failures are held back instead of being stored. A pass, or a
+    known-good file that still plays after `threshold` failures in a row, means
+    they are real and they are recorded. If the known-good file fails too, the
+    breaker opens: held failures are dropped, their items are queued again and
+    scanning pauses, probing the known-good file with backoff until it plays.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+
+    def __init__(self, ctx, threshold, backoff=30, max_backoff=900):
+        self.ctx = ctx
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.pending = []
+        self.retry = []
+        self.trips = 0
+        self.delay = backoff
+        self.next_probe = 0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.publish()
+
+    def publish(self):
+        state['servers'][self.ctx['server']['name']]['breaker'] = {
+            'state': self.state,
+            'consecutive_failures': len(self.pending),
+            'threshold': self.threshold,
+            'trips': self.trips,
+            'next_probe_in': max(0, int(self.next_probe - time.time())) if self.state == self.OPEN else None
+        }
+        state['breaker_open'] = any((s.get('breaker') or {}).get('state') == self.OPEN
+                                    for s in state['servers'].values())
+
+    def hold(self, conn, result, work_item):
+        """Takes a transcode failure. It is recorded once the breaker knows it's genuine."""
+        with self.lock:
+            if self.state == self.OPEN:
+                self._discard([(result, work_item)])
+                return
+            self.pending.append((result, work_item))
+            if len(self.pending) < self.threshold:
+                self.publish()
+                return
+            held = self.pending
+            self.pending = []
+
+        name = self.ctx['server']['name']
+        print(f"   [BREAKER] {len(held)} failures in a row on {name}, checking a known-good file")
+        healthy = self.check_health()
+        if healthy is False:
+            with self.lock:
+                self.state = self.OPEN
+                self.trips += 1
+                self.delay = self.backoff
+                self.next_probe = time.time() + self.delay
+                self._discard(held)
+                self.publish()
+            state['servers'][name]['status'] = 'Paused (transcoder down)'
+            print(f"   [BREAKER] Transcoder on {name} appears down, pausing scan")
+            send_canary_alert(self.ctx['settings'], f"Plex server '{name}'", "OUTAGE",
+                              f"{len(held)} files failed in a row and a known-good file failed too. Scanning is paused until the transcoder recovers.")
+        else:
+            for held_result, _ in held:
+                record_result(conn, self.ctx, held_result)
+            self.publish()
+
+    def release(self, conn):
+        """A transcode passed, so the failures held before it were genuine."""
+        with self.lock:
+            held = self.pending
+            self.pending = []
+        for held_result, _ in held:
+            record_result(conn, self.ctx, held_result)
+        if held:
+            self.publish()
+
+    def _discard(self, held):
+        # Caller holds the lock. These items will be tested again after recovery.
+        for _, work_item in held:
+            self.retry.append(work_item)
+            bump(self.ctx, 'scanned', -1)
+
+    def take_retry(self):
+        with self.lock:
+            retry = self.retry
+            self.retry = []
+        return retry
+
+    def wait(self):
+        """Blocks while the breaker is open. One caller probes for recovery with exponential backoff."""
+        name = self.ctx['server']['name']
+        while self.state == self.OPEN and not restart_event.is_set() and not stop_event.is_set():
+            with self.lock:
+                is_prober = not self.probing and time.time() >= self.next_probe
+                if is_prober:
+                    self.probing = True
+            if not is_prober:
+                self.publish()
+                time.sleep(1)
+                continue
+
+            healthy = self.check_health()
+            with self.lock:
+                self.probing = False
+                if healthy is False:
+                    self.delay = min(self.delay * 2, self.max_backoff)
+                    self.next_probe = time.time() + self.delay
+                    print(f"   [BREAKER] Transcoder on {name} still down, next check in {self.delay}s")
+                else:
+                    self.state = self.CLOSED
+                    # Anything that failed while we were waiting is suspect as well
+                    self._discard(self.pending)
+                    self.pending = []
+                self.publish()
+            if healthy is not False:
+                state['servers'][name]['status'] = 'Scanning'
+                print(f"   [BREAKER] Transcoder on {name} recovered, resuming scan")
+                send_canary_alert(self.ctx['settings'], f"Plex server '{name}'", "RECOVERED",
+                                  "A known-good file plays again. Scanning has resumed.")
+
+    def check_health(self):
+        """
+        Transcodes a canary file or the most recently passed file.
+        Returns True/False, or None when there is no known-good file to try.
+        """
+        for item in self.known_good_items():
+            return verify_stream(item, transcode_budget=self.ctx['budget'])
+        return None
+
+    def known_good_items(self):
+        plex = self.ctx['plex']
+        rating_keys = list(self.ctx['canary_ids'])
+        conn = connect_db()
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT rating_key FROM file_checks
+                         WHERE server=? AND status='PASS' AND verdict_source='probe' AND rating_key IS NOT NULL
+                         ORDER BY last_checked DESC LIMIT 3''', (self.ctx['server']['name'],))
+            rating_keys += [r[0] for r in c.fetchall()]
+        finally:
+            conn.close()
+        for key in rating_keys:
+            try:
+                yield plex.fetchItem(int(key))
+            except Exception:
+                continue
+
+    def flush(self, conn):
+        """End of scan: failures still held never hit the threshold, so they are genuine."""
+        self.release(conn)
+
+def new_breaker(ctx):
+    settings = ctx['settings']
+    threshold = int(settings.get('breaker_threshold', 5))
+    if threshold <= 0:
+        return None
+    return TranscoderBreaker(ctx, threshold,
+                             backoff=int(settings.get('breaker_backoff', 30)),
+                             max_backoff=int(settings.get('breaker_max_backoff', 900)))
+
+# --- PLEX NOTIFICATIONS ---
+
+# server name -> (listener, (url, token))
+_event_listeners = {}
+
+# Seconds between health checks of the listeners while sleeping
+LISTENER_CHECK_INTERVAL = 60
+
+def sync_event_listener(ctx):
+    """
+    Starts, restarts or stops the websocket listener of the context's server so
+    it matches the current settings. Returns the active listener (or None).
+    """
+    settings = ctx['settings']
+    server = ctx['server']
+    enabled = settings.get('plex_events_enabled', False)
+    key = (server['plex_url'], server['plex_token'])
+
+    listener, listener_key = _event_listeners.get(server['name'], (None, None))
+    if listener and (not enabled or key != listener_key or not listener.is_alive()):
+        listener.stop()
+        listener = None
+        del _event_listeners[server['name']]
+
+    if enabled and listener is None:
+        try:
+            listener = PlexEventListener(ctx['plex'],
+                                         debounce=int(settings.get('event_debounce', 30)),
+                                         max_wait=int(settings.get('event_max_wait', 300)))
+            listener.start()
+            _event_listeners[server['name']] = (listener, key)
+            print(f"Listening for Plex library notifications ({server['name']})")
+        except Exception as e:
+            print(f"Could not start Plex event listener ({server['name']}): {e}")
+            listener = None
+    return listener
+
+def stop_removed_listeners(servers):
+    names = {s['name'] for s in servers}
+    for name in list(_event_listeners):
+        if name not in names:
+            _event_listeners.pop(name)[0].stop()
+
+def event_work(conn, server_name, items):
+    """
+    Turns event items into scan queue entries. Plex also reports metadata
+    refreshes as finished items, so only files whose size or mtime changed
+    (or that were never checked) bypass the PASS cache.
+    """
+    work = []
+    c = conn.cursor()
+    for lib_name, item in items:
+        changed = False
+        for media in item.media:
+            for part in media.parts:
+                fingerprint = get_file_fingerprint(item, part, server_name)
+                c.execute("SELECT file_size, mtime FROM file_checks WHERE server=? AND file_path=?",
+                          (server_name, fingerprint['path']))
+                if c.fetchone() != (fingerprint['size'], fingerprint['mtime']):
+                    changed = True
+        work.append((lib_name, item, changed, None))
+    return work
+
+def load_event_items(plex, rating_keys, libraries):
+    """Fetches the items behind a batch of notifications, keeping only configured libraries."""
+    items = []
+    for key in rating_keys:
+        try:
+            item = plex.fetchItem(int(key))
+        except Exception as e:
+            print(f"   [EVENT] Could not load item {key}: {e}")
+            continue
+        lib_name = getattr(item, 'librarySectionTitle', None)
+        if lib_name in libraries and item.type in ('movie', 'episode'):
+            items.append((lib_name, item))
+    return items
+
+def queue_event_items(conn, ctx, scan_queue):
+    """Pushes a ready notification batch to the front of a running scan queue."""
+    listener = ctx['listener']
+    if not listener:
+        return
+    event_items = load_event_items(ctx['plex'], listener.pop_batch(), ctx['server']['libraries'])
+    if event_items:
+        print(f"[EVENT] Queued {len(event_items)} new or updated item(s)")
+        scan_queue.extendleft(reversed(event_work(conn, ctx['server']['name'], event_items)))
+        bump(ctx, 'total_items', len(event_items))
+
+def run_event_batch(ctx, rating_keys):
+    """Scans a debounced batch of new/updated items outside of the full scan."""
+    server = ctx['server']
+    items = load_event_items(ctx['plex'], rating_keys, server['libraries'])
+    if not items:
+        return
+
+    print(f"[EVENT] Scanning {len(items)} new or updated item(s) on {server['name']}")
+    conn = connect_db()
+    try:
+        work = event_work(conn, server['name'], items)
+    finally:
+        conn.close()
+    run_batch(ctx, work)
+
+def run_batch(ctx, work):
+    """Scans a list of (library, item, force, job) outside of the full scan."""
+    server = ctx['server']
+    before = {k: state[k] for k in ('scanned', 'passed', 'failed', 'skipped')}
+    previous_status = state['status']
+    state['status'] = 'Scanning'
+    state['servers'][server['name']]['status'] = 'Scanning'
+    batch_ctx = new_scan_context(ctx['settings'], server, ctx['plex'])
+    load_signature_rules(batch_ctx)
+    breaker = batch_ctx['breaker'] = new_breaker(batch_ctx)
+    batch = collections.deque(work)
+    sample_interval = int(ctx['settings'].get('history_sample_interval', 60))
+    # While other servers scan, their interval window is already open
+    own_window = not timeseries.is_open(timeseries.INTERVAL)
+    if own_window:
+        timeseries.start_window(timeseries.INTERVAL)
+    conn = connect_db()
+    try:
+        while batch and not stop_event.is_set() and not restart_event.is_set():
+            lib_name, item, force, job = batch.popleft()
+            try:
+                process_item(conn, batch_ctx, lib_name, item, force=force, job=job)
+            except Exception as e:
+                print(f"   [ERROR] {getattr(item, 'title', item)}: {e}")
+                if job:
+                    record_job_error(conn, job, item, str(e))
+            timeseries.record_item()
+            timeseries.maybe_close_interval(conn, sample_interval)
+            if breaker:
+                breaker.wait()
+                batch.extendleft(reversed(breaker.take_retry()))
+        if breaker:
+            breaker.flush(conn)
+        if own_window:
+            timeseries.close_window(conn, timeseries.INTERVAL, restart=False)
+    finally:
+        conn.close()
+        state['status'] = 'Scanning' if previous_status == 'Scanning' else 'Sleeping'
+        state['servers'][server['name']]['status'] = 'Sleeping'
+        set_activity(batch_ctx, current_file='', current_activity='', current_library='')
+
+    if batch_ctx['new_discord_failures'] and ctx['settings'].get('notify_on_failure', True):
+        batch_stats = {k: state[k] - before[k] for k in before}
+        batch_stats['subtitle_stats'] = {}
+        send_discord_report(ctx['settings'], batch_stats, batch_ctx['new_discord_failures'])
+
+# --- SCAN JOBS ---
+
+# Finished jobs are kept this long
+JOB_RETENTION_DAYS = 7
+
+# Seconds between checks for new jobs
+JOB_POLL_INTERVAL = 2
+
+def create_scan_job(server_name, job_request):
+    """
+    Queues an on-demand scan. job_request holds one of 'rating_keys', 'library'
+    or 'path_prefix'. The scanner picks the job up from the database, so this
+    works from the web process as well. Returns the job id.
+    """
+    job_id = uuid.uuid4().hex
+    conn = connect_db()
+    try:
+        conn.execute("INSERT INTO scan_jobs (id, server, request, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                     (job_id, server_name, json.dumps(job_request), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+    return job_id
+
+def get_scan_job(job_id):
+    """Returns a job with its progress and per-file results, or None."""
+    conn = connect_db()
+    try:
+        row = conn.execute('''SELECT id, server, request, status, created_at, started_at, finished_at, total, error
+                              FROM scan_jobs WHERE id=?''', (job_id,)).fetchone()
+        if not row:
+            return None
+        results = conn.execute('''SELECT file_path, title, status, reason, checked_at FROM scan_job_results
+                                  WHERE job_id=? ORDER BY checked_at''', (job_id,)).fetchall()
+    finally:
+        conn.close()
+
+    job = dict(zip(('id', 'server', 'request', 'status', 'created_at', 'started_at', 'finished_at', 'total', 'error'), row))
+    job['request'] = json.loads(job['request'])
+    job['results'] = [dict(zip(('file', 'title', 'status', 'reason', 'checked_at'), r)) for r in results]
+    job['processed'] = len(results)
+    if job['status'] == 'done':
+        job['progress'] = 100
+    else:
+        job['progress'] = int(job['processed'] / job['total'] * 100) if job['total'] else 0
+    return job
+
+def load_job_items(ctx, job_request):
+    """Resolves a job request into (library, item) pairs on the context's server."""
+    plex = ctx['plex']
+    if job_request.get('rating_keys'):
+        items = []
+        for key in job_request['rating_keys']:
+            item = plex.fetchItem(int(key))
+            lib_name = getattr(item, 'librarySectionTitle', None)
+            if item.type in ('show', 'season'):
+                items.extend((lib_name, episode) for episode in item.episodes())
+            elif item.type in ('movie', 'episode'):
+                items.append((lib_name, item))
+        return items
+    if job_request.get('library'):
+        return enumerate_items(plex, [job_request['library']])
+    prefix = job_request['path_prefix']
+    # Only walk the libraries whose folders can contain the prefix
+    sections = [lib.title for lib in plex.library.sections()
+                if lib.type in ('movie', 'show') and any(prefix.startswith(loc) or loc.startswith(prefix) for loc in lib.locations)]
+    return [(lib_name, item) for lib_name, item in enumerate_items(plex, sections)
+            if any(part.file.startswith(prefix) for media in item.media for part in media.parts)]
+
+def dedupe_job_items(items):
+    """
+    Drops items whose files are all in the job already: multi-episode files,
+    repeated rating keys, or a show together with one of its episodes. Results
+    are stored per file, so the job's total is the number of distinct files.
+    Returns (items, total).
+    """
+    seen = set()
+    unique = []
+    for lib_name, item in items:
+        files = {part.file for media in item.media for part in media.parts}
+        if files - seen:
+            unique.append((lib_name, item))
+            seen |= files
+    return unique, len(seen)
+
+def claim_scan_jobs(ctx):
+    """
+    Takes the server's queued jobs and returns their work items,
+    (library, item, True, job_id), to be scanned ahead of everything else.
+    """
+    now = time.time()
+    if now - ctx.get('jobs_checked', 0) < JOB_POLL_INTERVAL:
+        return []
+    ctx['jobs_checked'] = now
+
+    work = []
+    conn = connect_db()
+    try:
+        rows = conn.execute("SELECT id, request FROM scan_jobs WHERE server=? AND status='queued' ORDER BY created_at",
+                            (ctx['server']['name'],)).fetchall()
+        for job_id, job_request in rows:
+            # Another worker may have claimed it in the meantime
+            claimed = conn.execute("UPDATE scan_jobs SET status='running', started_at=? WHERE id=? AND status='queued'",
+                                   (time.time(), job_id))
+            conn.commit()
+            if not claimed.rowcount:
+                continue
+            try:
+                items = load_job_items(ctx, json.loads(job_request))
+            except Exception as e:
+                print(f"[JOB {job_id[:8]}] Could not load items: {e}")
+                conn.execute("UPDATE scan_jobs SET status='error', error=?, finished_at=? WHERE id=?", (str(e), time.time(), job_id))
+                conn.commit()
+                continue
+            items, total = dedupe_job_items(items)
+            conn.execute("UPDATE scan_jobs SET total=? WHERE id=?", (total, job_id))
+            complete_job(conn, job_id)
+            print(f"[JOB {job_id[:8]}] Queued {len(items)} item(s), {total} part(s)")
+            work.extend((lib_name, item, True, job_id) for lib_name, item in items)
+    finally:
+        conn.close()
+    return work
+
+def record_job_result(conn, job_id, file_path, title, status, reason=None):
+    conn.execute('''INSERT OR REPLACE INTO scan_job_results (job_id, file_path, title, status, reason, checked_at)
+                    VALUES (?, ?, ?, ?, ?, ?)''', (job_id, file_path, title, status, reason, time.time()))
+    complete_job(conn, job_id)
+
+def record_job_error(conn, job_id, item, error):
+    """Gives the parts of an item that raised an exception an ERROR result, so the job can finish."""
+    for media in getattr(item, 'media', []):
+        for part in media.parts:
+            conn.execute('''INSERT OR IGNORE INTO scan_job_results (job_id, file_path, title, status, reason, checked_at)
+                            VALUES (?, ?, ?, 'ERROR', ?, ?)''', (job_id, part.file, get_display_title(item), error, time.time()))
+    complete_job(conn, job_id)
+
+def complete_job(conn, job_id):
+    """Marks a running job done once every part has a result."""
+    conn.execute('''UPDATE scan_jobs SET status='done', finished_at=?
+                    WHERE id=? AND status='running' AND total IS NOT NULL
+                      AND total <= (SELECT COUNT(*) FROM scan_job_results WHERE job_id=?)''',
+                 (time.time(), job_id, job_id))
+    conn.commit()
+
+def reset_scan_jobs(conn):
+    """
+    Requeues jobs interrupted by a restart and drops old finished ones.
+    Called between scan cycles, when no job is in progress.
+    """
+    cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+    conn.execute("UPDATE scan_jobs SET status='queued' WHERE status='running'")
+    conn.execute("DELETE FROM scan_job_results WHERE job_id IN (SELECT id FROM scan_jobs WHERE finished_at < ?)", (cutoff,))
+    conn.execute("DELETE FROM scan_jobs WHERE finished_at < ?", (cutoff,))
+    conn.commit()
+
+# --- LIBRARY SCHEDULES ---
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def default_scan_interval(settings, server_name):
+    """The interval of libraries without their own schedule; longer while Plex notifications are live."""
+    listener, _ = _event_listeners.get(server_name, (None, None))
+    if listener and listener.is_alive():
+        return int(settings.get('reconcile_interval', 86400))
+    return int(settings.get('scan_interval', 3600))
+
+def parse_library_schedule(schedule):
+    """
+    Checks the schedule keys of a per_library_settings entry.
+    Returns (interval or None, windows, days); raises ValueError if one is invalid.
+    """
+    interval = schedule.get('scan_interval')
+    if interval not in (None, ''):
+        try:
+            if isinstance(interval, bool):
+                raise ValueError
+            interval = float(interval)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid scan_interval '{interval}', expected seconds")
+        if interval <= 0:
+            raise ValueError("scan_interval must be positive")
+    else:
+        interval = None
+
+    windows = schedule.get('scan_window') or []
+    if isinstance(windows, str):
+        windows = [windows]
+    if not isinstance(windows, list):
+        raise ValueError("scan_window must be 'HH:MM-HH:MM' or a list of them")
+    for window in windows:
+        budget.parse_window(window)
+
+    days = schedule.get('scan_days') or []
+    if isinstance(days, str):
+        days = [days]
+    # 'sat' or 'saturday'
+    valid_days = WEEKDAYS + WEEKDAY_NAMES
+    if not isinstance(days, list) or not all(isinstance(d, str) and d.strip().lower() in valid_days for d in days):
+        raise ValueError(f"Invalid scan_days {days!r}, expected e.g. [\"sat\", \"sun\"]")
+    return interval, windows, [d.strip().lower()[:3] for d in days]
+
+def library_schedule(settings, lib_name):
+    """The library's parsed schedule. An invalid one is logged and ignored rather than stopping the scan loop."""
+    schedule = settings.get('per_library_settings', {}).get(lib_name, {})
+    try:
+        return parse_library_schedule(schedule)
+    except ValueError as e:
+        print(f"Ignoring the schedule of library '{lib_name}': {e}")
+        return None, [], []
+
+def next_library_run(settings, lib_name, last_run, default_interval):
+    """
+    When a library is next due. per_library_settings[lib_name] may set
+    `scan_interval` (seconds after the last run), `scan_window` ("HH:MM-HH:MM"
+    or a list of them) and `scan_days` (e.g. ["sat", "sun"]); a run only
+    starts inside the window, on one of the days.
+    """
+    if last_run is None:
+        return 0
+    interval, windows, days = library_schedule(settings, lib_name)
+    next_run = datetime.datetime.fromtimestamp(last_run + (interval or default_interval))
+    # Move forward to the first allowed day and window (at most a week plus one window)
+    for _ in range(16):
+        day_ok = not days or WEEKDAYS[next_run.weekday()] in days
+        if day_ok and (not windows or any(budget.in_window(w, next_run) for w in windows)):
+            break
+        if day_ok:
+            minutes = budget.minutes_until_window(windows, next_run)
+            next_run = next_run.replace(second=0, microsecond=0) + datetime.timedelta(minutes=minutes)
+        else:
+            next_run = (next_run + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return next_run.timestamp()
+
+def load_library_runs(conn, server_name):
+    c = conn.cursor()
+    c.execute("SELECT library, last_run FROM library_schedule WHERE server=?", (server_name,))
+    return dict(c.fetchall())
+
+# Longest wait before a library whose scan failed is tried again
+LIBRARY_RETRY_DELAY = 300
+
+# (server, library) -> when a failed scan is retried
+_library_retry = {}
+
+def library_next_runs(conn, settings, server):
+    """Next run of each of the server's libraries, pushed back to its retry time after a failed scan."""
+    last_runs = load_library_runs(conn, server['name'])
+    interval = default_scan_interval(settings, server['name'])
+    return {lib: max(next_library_run(settings, lib, last_runs.get(lib), interval),
+                     _library_retry.get((server['name'], lib), 0))
+            for lib in server['libraries']}
+
+def due_libraries(conn, settings, server, now=None):
+    """The server's libraries whose next run has come. Libraries never scanned are always due."""
+    now = now or time.time()
+    return [lib for lib, next_run in library_next_runs(conn, settings, server).items() if next_run <= now]
+
+def next_wake_time(conn, settings, servers):
+    """The earliest next run of any library."""
+    next_runs = [next_run for server in servers for next_run in library_next_runs(conn, settings, server).values()]
+    return min(next_runs) if next_runs else time.time() + int(settings.get('scan_interval', 3600))
+
+def mark_libraries_scanned(server_name, libraries):
+    conn = connect_db()
+    try:
+        now = time.time()
+        conn.executemany("INSERT OR REPLACE INTO library_schedule (server, library, last_run) VALUES (?, ?, ?)",
+                         [(server_name, lib, now) for lib in libraries])
+        conn.commit()
+    finally:
+        conn.close()
+    for lib in libraries:
+        _library_retry.pop((server_name, lib), None)
+
+def retry_libraries_later(settings, server_name, libraries):
+    """
+    After a failed scan (e.g. Plex restarting), tries the libraries again after
+    their interval or LIBRARY_RETRY_DELAY, whichever is shorter, instead of
+    counting the run as done.
+    """
+    default_interval = default_scan_interval(settings, server_name)
+    for lib in libraries:
+        delay = min(library_schedule(settings, lib)[0] or default_interval, LIBRARY_RETRY_DELAY)
+        _library_retry[(server_name, lib)] = time.time() + delay
+
+# --- SCANNING ---
+
+def enumerate_items(plex, libraries):
+    """Lists (library, item) for every movie and episode in the given libraries."""
+    items_with_lib = []
+    for lib_name in libraries:
+        if restart_event.is_set(): break 
+        try:
+            lib = plex.library.section(lib_name)
+            if lib.type == 'show':
+                for show in lib.all():
+                    for episode in show.episodes():
+                        items_with_lib.append((lib_name, episode))
+            elif lib.type == 'movie':
+                for movie in lib.all():
+                    items_with_lib.append((lib_name, movie))
+        except:
+            pass
+    return items_with_lib
+
+def scan_worker(ctx, scan_queue):
+    """Takes items off a server's scan queue until it is empty."""
+    conn = connect_db()
+    try:
+        breaker = ctx['breaker']
+        sample_interval = int(ctx['settings'].get('history_sample_interval', 60))
+        while not restart_event.is_set() and not stop_event.is_set():
+            if breaker:
+                breaker.wait()
+                retry = breaker.take_retry()
+                if retry:
+                    scan_queue.extendleft(reversed(retry))
+                    bump(ctx, 'total_items', len(retry))
+            queue_event_items(conn, ctx, scan_queue)
+            job_work = claim_scan_jobs(ctx)
+            if job_work:
+                scan_queue.extendleft(reversed(job_work))
+                bump(ctx, 'total_items', len(job_work))
+            try:
+                lib_name, item, force, job = scan_queue.popleft()
+            except IndexError:
+                break
+            try:
+                process_item(conn, ctx, lib_name, item, force=force, job=job)
+            except Exception as e:
+                print(f"   [ERROR] {getattr(item, 'title', item)}: {e}")
+                if job:
+                    record_job_error(conn, job, item, str(e))
+            mark_processed(ctx)
+            timeseries.maybe_close_interval(conn, sample_interval)
+    finally:
+        conn.close()
+
+def plex_version_changed_at(conn, server_name, version):
+    """Records the server's Plex version and returns when it last changed (0 if never seen changing)."""
+    c = conn.cursor()
+    c.execute("SELECT version, changed_at FROM plex_versions WHERE server=?", (server_name,))
+    row = c.fetchone()
+    if row and row[0] == version:
+        return row[1]
+    changed_at = time.time() if row else 0
+    if row:
+        print(f"[{server_name}] Plex version changed from {row[0]} to {version}")
+    c.execute("INSERT OR REPLACE INTO plex_versions (server, version, changed_at) VALUES (?, ?, ?)",
+              (server_name, version, changed_at))
+    conn.commit()
+    return changed_at
+
+# server name -> {(library, signature): share of a file carried over to the next cycle}
+_reverify_credit = {}
+
+def allocate_reverify(shares, credit):
+    """
+    Splits one cycle's re-verification over the (library, signature) groups.
+    shares holds the files each group is due this cycle, usually fractions of
+    one. The cycle takes the whole files of the total (plus what earlier cycles
+    carried over) and hands them out by largest remainder. What a group was owed
+    but didn't get is carried over, so small groups get their turn in later
+    cycles. Returns (files per group, carry-over per group).
+    """
+    owed = {group: share + credit.get(group, 0.0) for group, share in shares.items()}
+    total = max(0, math.floor(sum(owed.values()) + 1e-9))
+    counts = {group: max(0, math.floor(amount)) for group, amount in owed.items()}
+    remainder = lambda group: owed[group] - counts[group]
+    left = total - sum(counts.values())
+    if left > 0:
+        for group in sorted(owed, key=remainder, reverse=True)[:left]:
+            counts[group] += 1
+    elif left < 0:
+        # Groups in debt from earlier extra files hold the others back
+        for group in sorted((g for g in owed if counts[g]), key=remainder)[:-left]:
+            counts[group] -= 1
+    return counts, {group: owed[group] - counts[group] for group in owed}
+
+def reverify_enabled(settings):
+    return float(settings.get('reverify_fraction', 0)) > 0 or float(settings.get('reverify_days', 0)) > 0
+
+def load_reverify_set(ctx):
+    """
+    Picks the unchanged PASS files this cycle tests again, so every library is
+    re-verified every `reverify_days`. Each library's share is the time since
+    its last run divided by `reverify_days`, as libraries can run on their own
+    schedules. The cycle's files are spread over the codec profiles (signatures)
+    in proportion to their size (see allocate_reverify), oldest last_checked
+    first within a profile. For `reverify_boost_days`
+    after a Plex version change, the rate is multiplied by `reverify_boost_factor`.
+    """
+    settings = ctx['settings']
+    server_name = ctx['server']['name']
+    ctx['reverify'] = set()
+
+    fixed_fraction = float(settings.get('reverify_fraction', 0))
+    reverify_days = float(settings.get('reverify_days', 0))
+    if fixed_fraction <= 0 and reverify_days <= 0:
+        return
+
+    conn = connect_db()
+    try:
+        boost = 1.0
+        changed_at = plex_version_changed_at(conn, server_name, getattr(ctx['plex'], 'version', None))
+        if time.time() - changed_at < float(settings.get('reverify_boost_days', 3)) * 86400:
+            boost = float(settings.get('reverify_boost_factor', 5))
+
+        # Only libraries scanned this cycle; files from before library names were stored go with the default interval
+        default_interval = default_scan_interval(settings, server_name)
+        last_runs = load_library_runs(conn, server_name)
+        c = conn.cursor()
+        shares = {}
+        for lib_name in ctx['libraries'] + [None]:
+            if fixed_fraction > 0:
+                fraction = fixed_fraction
+            else:
+                last_run = last_runs.get(lib_name)
+                period = time.time() - last_run if last_run else (library_schedule(settings, lib_name)[0] or default_interval)
+                fraction = period / (reverify_days * 86400)
+            fraction = min(1.0, fraction * boost)
+
+            in_library = "library_name IS NULL" if lib_name is None else "library_name=?"
+            lib_args = () if lib_name is None else (lib_name,)
+            c.execute(f'''SELECT COALESCE(signature, ''), COUNT(*) FROM file_checks
+                          WHERE server=? AND status='PASS' AND {in_library} GROUP BY COALESCE(signature, '')''',
+                      (server_name, *lib_args))
+            for signature, count in c.fetchall():
+                shares[(lib_name, signature)] = count * fraction
+
+        credit = _reverify_credit.setdefault(server_name, {})
+        counts, carried = allocate_reverify(shares, credit)
+        credit.update(carried)
+        for (lib_name, signature), count in counts.items():
+            if not count:
+                continue
+            in_library = "library_name IS NULL" if lib_name is None else "library_name=?"
+            lib_args = () if lib_name is None else (lib_name,)
+            c.execute(f'''SELECT file_path FROM file_checks
+                          WHERE server=? AND status='PASS' AND {in_library} AND COALESCE(signature, '')=?
+                          ORDER BY last_checked LIMIT ?''', (server_name, *lib_args, signature, count))
+            ctx['reverify'].update(r[0] for r in c.fetchall())
+    finally:
+        conn.close()
+    if ctx['reverify']:
+        print(f"[{server_name}] Re-verifying {len(ctx['reverify'])} PASS file(s) this cycle")
+
+def forecast_scan(ctx, items_with_lib):
+    """Counts the parts that are cached and those that need a test, and publishes the expected scan duration."""
+    server = ctx['server']
+    to_skip = 0
+    to_test = 0
+    conn = connect_db()
+    try:
+        for lib_name, item in items_with_lib:
+            is_canary = str(item.ratingKey) in ctx['canary_ids']
+            for media in item.media:
+                for part in media.parts:
+                    fingerprint = get_file_fingerprint(item, part, server['name'])
+                    if not is_canary and fingerprint['path'] not in ctx['reverify'] and should_skip(conn, fingerprint):
+                        to_skip += 1
+                    else:
+                        to_test += 1
+    finally:
+        conn.close()
+
+    eta = ctx['estimator'].forecast(to_skip, to_test, server['concurrency'], ctx['throttle'])
+    forecast = {'parts_cached': to_skip, 'parts_to_test': to_test, 'eta_seconds': eta}
+    with state_lock:
+        server_state = state['servers'][server['name']]
+        server_state['forecast'] = forecast
+        server_state['eta_seconds'] = eta
+        state['forecast'] = {key: sum((s['forecast'] or {}).get(key, 0) for s in state['servers'].values())
+                             for key in ('parts_cached', 'parts_to_test')}
+        state['eta_seconds'] = max(s['eta_seconds'] or 0 for s in state['servers'].values())
+        state['forecast']['eta_seconds'] = state['eta_seconds']
+    print(f"[{server['name']}] Forecast: {to_test} part(s) to test, {to_skip} cached, "
+          f"about {datetime.timedelta(seconds=eta)}")
+
+def serve_idle_server(ctx):
+    """
+    Runs the notification batches and /api/scan jobs of a server with no library
+    due, while other servers scan. Otherwise they'd wait for the end of the cycle.
+    """
+    cycle_done = ctx['cycle_done']
+    while not cycle_done.is_set() and not stop_event.is_set() and not restart_event.is_set():
+        if ctx['listener']:
+            batch = ctx['listener'].pop_batch()
+            if batch:
+                run_event_batch(ctx, batch)
+        job_work = claim_scan_jobs(ctx)
+        if job_work:
+            run_batch(ctx, job_work)
+        cycle_done.wait(1)
+
+def scan_server(ctx):
+    """Enumerates one server's libraries and runs its worker group over them."""
+    server = ctx['server']
+    server_state = state['servers'][server['name']]
+    try:
+        server_state['status'] = 'Scanning'
+        server_state['current_activity'] = 'Starting...'
+        ctx['plex'] = plex_clients.get_client(server['plex_url'], server['plex_token'])
+        ctx['listener'] = sync_event_listener(ctx)
+        if not ctx['libraries']:
+            # Nothing due; keep up with events and jobs until the other servers are done
+            server_state['status'] = 'Sleeping'
+            server_state['current_activity'] = ''
+            serve_idle_server(ctx)
+            return
+        load_signature_rules(ctx)
+        ctx['breaker'] = new_breaker(ctx)
+        ctx['budget'].reset_usage()
+        load_reverify_set(ctx)
+
+        items_with_lib = enumerate_items(ctx['plex'], ctx['libraries'])
+        # Canary files in libraries that aren't due are still tested every cycle
+        idle_libraries = [lib for lib in server['libraries'] if lib not in ctx['libraries']]
+        if idle_libraries and ctx['canary_ids']:
+            items_with_lib += load_event_items(ctx['plex'], ctx['canary_ids'], idle_libraries)
+        bump(ctx, 'total_items', len(items_with_lib))
+        ctx['item_count'] = len(items_with_lib)
+
+        forecast_scan(ctx, items_with_lib)
+
+        priority = ctx['settings'].get('priority_title', '').strip().lower()
+        if priority:
+            def priority_sort_key(item_tuple):
+                lib_name, item = item_tuple
+                if item.title and priority in item.title.lower(): return 0
+                if hasattr(item, 'grandparentTitle') and item.grandparentTitle:
+                    if priority in item.grandparentTitle.lower(): return 0
+                return 1
+            items_with_lib.sort(key=priority_sort_key)
+
+        # Scan queue: (library, item, force, job). Items reported by Plex notifications
+        # and /api/scan jobs are pushed to the front while the scan runs.
+        scan_queue = collections.deque((lib_name, item, False, None) for lib_name, item in items_with_lib)
+        workers = [threading.Thread(target=scan_worker, args=(ctx, scan_queue), daemon=True,
+                                    name=f"scanner-{server['name']}-worker{n + 1}")
+                   for n in range(server['concurrency'])]
+        for w in workers: w.start()
+        for w in workers: w.join()
+
+        if ctx['breaker']:
+            conn = connect_db()
+            try:
+                ctx['breaker'].flush(conn)
+            finally:
+                conn.close()
+
+        if restart_event.is_set():
+            server_state['status'] = 'Restarting...'
+        elif not stop_event.is_set():
+            server_state['status'] = 'Complete'
+            server_state['progress'] = 100
+            mark_libraries_scanned(server['name'], ctx['libraries'])
+    except Exception as e:
+        print(f"CRITICAL ERROR ({server['name']}): {e}")
+        plex_clients.invalidate(server['plex_url'], server['plex_token'])
+        ctx['error'] = str(e)
+        server_state['status'] = f"Error: {str(e)}"
+        # Try again after a short delay rather than right away
+        retry_libraries_later(ctx['settings'], server['name'], ctx['libraries'])
+
 def run_scan_loop():
     while not stop_event.is_set():
         if restart_event.is_set():
@@ -361,250 +2127,73 @@ def run_scan_loop():
 
         settings = load_settings()
         
-        notify_immediate = settings.get('notify_immediate', False)
         notify_on_failure = settings.get('notify_on_failure', True)
         notify_on_success = settings.get('notify_on_success', False)
         
-        if not settings.get('plex_url') or not settings.get('plex_token'):
+        try:
+            servers = get_servers(settings)
+        except Exception as e:
+            print(f"Invalid server settings: {e}")
+            state['status'] = f"Error: {str(e)}"
+            time.sleep(60)
+            continue
+        stop_removed_listeners(servers)
+        if not servers:
             state['status'] = 'Not Configured'
             time.sleep(5)
             continue
 
         try:
-            state['status'] = 'Scanning'
-            state['current_activity'] = 'Starting...'
-            state['scanned'] = 0
-            state['skipped'] = 0
-            state['failed'] = 0
-            state['passed'] = 0
-            state['failures'] = [] 
-            state['subtitle_stats'] = {} 
-            state['ignored_subtitle_stats'] = {}
-            state['audio_stats'] = {}
-            state['audio_stats_unexpected'] = {}
-            state['current_library'] = ''
-            
-            new_discord_failures = []
-            
             conn = init_db()
-            plex = PlexServer(settings['plex_url'], settings['plex_token'])
-            
-            # Global language expansion map
-            EXPANSION_MAP = {
-                'en': ['en', 'eng'],
-                'no': ['no', 'nor', 'nob', 'nno'],
-                'sv': ['sv', 'swe'],
-                'da': ['da', 'dan'],
-                'de': ['de', 'ger', 'deu'],
-                'fr': ['fr', 'fre', 'fra'],
-                'es': ['es', 'spa'],
-                'it': ['it', 'ita'],
-                'ja': ['ja', 'jpn'],
-                'zh': ['zh', 'chi', 'zho']
-            }
-            
-            notify_audio_mismatch = settings.get('notify_audio_mismatch', False)
-            
-            libraries = settings.get('libraries', [])
-            
-            # Canary file setup
-            canary_file = settings.get('canary_files', [])
-            canary_ids = [str(x['id']) for x in canary_file]
-            found_canary_ids = set()
+            reset_scan_jobs(conn)
+            contexts = [new_scan_context(settings, server) for server in servers]
 
-            # Build library-indexed items with library names
-            items_with_lib = []
-            
-            for lib_name in libraries:
-                if restart_event.is_set(): break 
-                try:
-                    lib = plex.library.section(lib_name)
-                    if lib.type == 'show':
-                        for show in lib.all():
-                            for episode in show.episodes():
-                                items_with_lib.append((lib_name, episode))
-                    elif lib.type == 'movie':
-                        for movie in lib.all():
-                            items_with_lib.append((lib_name, movie))
-                except:
-                    pass
-
-            state['total_items'] = len(items_with_lib)
-            
-            priority = settings.get('priority_title', '').strip().lower()
-            if priority:
-                def priority_sort_key(item_tuple):
-                    lib_name, item = item_tuple
-                    if item.title and priority in item.title.lower(): return 0
-                    if hasattr(item, 'grandparentTitle') and item.grandparentTitle:
-                        if priority in item.grandparentTitle.lower(): return 0
-                    return 1
-                items_with_lib.sort(key=priority_sort_key)
-
-            for idx, (lib_name, item) in enumerate(items_with_lib):
-                if restart_event.is_set(): 
-                    state['status'] = 'Restarting...'
-                    break
-                if stop_event.is_set(): break
-                
-                state['progress'] = int((idx / max(1, len(items_with_lib))) * 100)
-                state['current_library'] = lib_name
-                display_title = item.title
-                if item.type == 'episode':
-                    display_title = f"{item.grandparentTitle} - {item.seasonEpisode} - {item.title}"
-                elif item.type == 'movie':
-                    display_title = f"{item.title} ({item.year})"
-                state['current_file'] = display_title
-
-                # Get per-library language settings
-                lang_setting = get_library_setting(settings, lib_name, 'target_languages', 'en, eng')
-                user_langs = [x.strip().lower() for x in lang_setting.split(',') if x.strip()]
-                target_languages = set(user_langs)
-                for code in user_langs:
-                    if code in EXPANSION_MAP:
-                        target_languages.update(EXPANSION_MAP[code])
-                target_languages = list(target_languages)
-                
-                # Get per-library audio language settings
-                audio_lang_setting = get_library_setting(settings, lib_name, 'target_audio_languages', '')
-                user_audio_langs = [x.strip().lower() for x in audio_lang_setting.split(',') if x.strip()]
-                target_audio_languages = set(user_audio_langs)
-                for code in user_audio_langs:
-                    if code in EXPANSION_MAP:
-                        target_audio_languages.update(EXPANSION_MAP[code])
-                target_audio_languages = list(target_audio_languages)
-
-                for media in item.media:
-                    for part in media.parts:
-                        fingerprint = get_file_fingerprint(item, part)
-                        
-                        # Canary file Check
-                        is_canary = str(item.ratingKey) in canary_ids
-                        file_changed = False
-                        
-                        c = conn.cursor()
-                        c.execute("SELECT file_size, mtime, status, audio_status FROM file_checks WHERE file_path=?", (fingerprint['path'],))
-                        row = c.fetchone()
-                        previous_status = row[2] if row else None
-                        previous_audio_status = row[3] if row else 'OK'
-                        
-                        # Check for file changes for ALL files, not just canaries
-                        if row:
-                            stored_size, stored_mtime, status, audio_status_old = row
-                            if stored_size != fingerprint['size'] or stored_mtime != fingerprint['mtime']:
-                                file_changed = True
-                        
-                        if is_canary:
-                            found_canary_ids.add(str(item.ratingKey))
-                            print(f"   [CANARY] Forcing scan on {display_title}")
-                            if file_changed:
-                                print(f"   [CANARY] File changed detected for {display_title}")
-
-                        if not is_canary and should_skip(conn, fingerprint):
-                            state['skipped'] += 1
-                            continue
-                            
-                        state['scanned'] += 1
-                        state['current_activity'] = "Video Stream"
-                        
-                        success = verify_stream(item)
-                        reason = "Video Transcode Failed"
+            # Only libraries whose schedule is due are scanned this cycle
+            for ctx in contexts:
+                ctx['libraries'] = due_libraries(conn, settings, ctx['server'])
+            scanning = any(ctx['libraries'] for ctx in contexts)
+            if scanning:
+                state['status'] = 'Scanning'
+                state['current_activity'] = 'Starting...'
+                reset_scan_stats(servers)
+                timeseries.start_window(timeseries.SCAN)
+                timeseries.start_window(timeseries.INTERVAL)
+            else:
+                # Keep the last scan's numbers on the dashboard
+                for server in servers:
+                    state['servers'].setdefault(server['name'], new_server_state())
 
-                        audio_status = 'OK'
-                        if success:
-                            item.reload()
-                            
-                            # Check audio language if configured
-                            if target_audio_languages:
-                                audio_streams = item.audioStreams()
-                                found_audio_langs = set()
-                                for audio in audio_streams:
-                                    audio_lang = audio.languageCode or 'unknown'
-                                    found_audio_langs.add(audio_lang)
-                                
-                                # Track expected vs unexpected audio languages
-                                for audio_lang in found_audio_langs:
-                                    if audio_lang in target_audio_languages:
-                                        state['audio_stats'][audio_lang] = state['audio_stats'].get(audio_lang, 0) + 1
-                                    else:
-                                        state['audio_stats_unexpected'][audio_lang] = state['audio_stats_unexpected'].get(audio_lang, 0) + 1
-                                
-                                # Check if we should flag an audio mismatch
-                                if notify_audio_mismatch:
-                                    # Check if AT LEAST ONE expected language is present
-                                    has_expected = any(lang in target_audio_languages for lang in found_audio_langs)
-                                    
-                                    # Mismatch ONLY if we found audio AND none of it is expected
-                                    if found_audio_langs and not has_expected:
-                                        audio_status = 'MISMATCH'
-                                        
-                                        # Only notify on NEW audio mismatches (not previously detected)
-                                        is_new_audio_mismatch = (previous_audio_status != 'MISMATCH')
-                                        if is_new_audio_mismatch:
-                                            expected_display = [lang for lang in target_audio_languages if lang != 'unknown']
-                                            found_display = list(found_audio_langs)
-                                            send_ntfy_audio_mismatch(
-                                                settings,
-                                                display_title,
-                                                part.file,
-                                                expected_display or target_audio_languages,
-                                                found_display
-                                            )
-                                            print(f"   [AUDIO MISMATCH] {display_title} - Expected: {target_audio_languages}, Found: {found_audio_langs}")
-                                        else:
-                                            print(f"   [AUDIO MISMATCH] {display_title} - Expected: {target_audio_languages}, Found: {found_audio_langs} (Known)")
-                            
-                            for sub in item.subtitleStreams():
-                                lang_code = sub.languageCode or 'unknown'
-                                if lang_code in target_languages:
-                                    state['current_activity'] = f"Subtitle: {lang_code}"
-                                    if not verify_stream(item, subtitle_stream=sub):
-                                        success = False
-                                        reason = f"Subtitle Failed: {sub.language}"
-                                        break
-                                    else:
-                                        state['subtitle_stats'][lang_code] = state['subtitle_stats'].get(lang_code, 0) + 1
-                                else:
-                                    state['ignored_subtitle_stats'][lang_code] = state['ignored_subtitle_stats'].get(lang_code, 0) + 1
-
-                        status = 'PASS' if success else 'FAIL'
-                        update_db(conn, fingerprint, status, audio_status, lib_name)
-
-                        if success:
-                            state['passed'] += 1
-                            if is_canary:
-                                if file_changed:
-                                    send_canary_alert(settings, display_title, "CHANGED", "The file was updated and PASSED the scan.")
-                                elif previous_status == 'FAIL':
-                                    send_canary_alert(settings, display_title, "RECOVERED", "The file failed previously but is now playable.")
-                        else:
-                            state['failed'] += 1
-                            failure_data = {'title': display_title, 'file': os.path.basename(part.file), 'reason': reason}
-                            state['failures'].append(failure_data)
-                            
-                            is_new_failure = (previous_status != 'FAIL' or file_changed)
-                            
-                            if is_canary:
-                                if file_changed:
-                                    send_canary_alert(settings, display_title, "CHANGED", f"The file was updated and FAILED the scan.\nReason: {reason}")
-                                elif is_new_failure:
-                                    send_canary_alert(settings, display_title, "OUTAGE", reason)
-                                    print(f"   [CANARY FILE FAIL] {display_title} (New)")
-                                else:
-                                    print(f"   [CANARY FILE FAIL] {display_title} (Known)")
-                            else:
-                                if is_new_failure:
-                                    if notify_immediate:
-                                        send_immediate_alert(settings, failure_data)
-                                    new_discord_failures.append(failure_data)
-                                    print(f"   [FAIL] {display_title} (New)")
-                                else:
-                                    print(f"   [FAIL] {display_title} (Known)")
-                        
-                        time.sleep(1)
+            # Each server gets its own worker group; they scan in parallel. Servers
+            # with nothing due handle events and jobs until the others are done.
+            cycle_done = threading.Event()
+            for ctx in contexts:
+                ctx['cycle_done'] = cycle_done
+            threads = [threading.Thread(target=scan_server, args=(ctx,), daemon=True, name=f"scanner-{ctx['server']['name']}")
+                       for ctx in contexts]
+            for t in threads: t.start()
+            for t, ctx in zip(threads, contexts):
+                if ctx['libraries']:
+                    t.join()
+            cycle_done.set()
+            for t in threads: t.join()
+
+            # Sampling stops while sleeping; event batches sample their own activity
+            timeseries.close_window(conn, timeseries.INTERVAL, restart=False)
+            timeseries.close_window(conn, timeseries.SCAN, restart=False)
+            timeseries.downsample(conn, float(settings.get('history_raw_days', 2)), float(settings.get('history_hourly_days', 30)))
+
+            if restart_event.is_set():
+                state['status'] = 'Restarting...'
+            elif all(ctx['error'] for ctx in contexts):
+                raise Exception(contexts[0]['error'])
+
+            if len(servers) > 1:
+                libraries = [f"{ctx['server']['name']}: {lib}" for ctx in contexts for lib in ctx['libraries']]
+            else:
+                libraries = contexts[0]['libraries']
 
             # --- END OF LOOP ---
-            if not restart_event.is_set() and not stop_event.is_set():
+            if scanning and not restart_event.is_set() and not stop_event.is_set():
                 # Get previous failures before saving new history
                 c = conn.cursor()
                 c.execute("SELECT failed FROM scan_history ORDER BY id DESC LIMIT 1")
@@ -615,24 +2204,26 @@ def run_scan_loop():
                 save_scan_history(conn, libraries, state)
                 
                 # Check for Missing Canary Files
-                missing_ids = set(canary_ids) - found_canary_ids
-                if missing_ids and len(items_to_process) > 0: # Ensure scan actually ran
-                    missing_titles = []
-                    for m_id in missing_ids:
-                        # Find title from settings
-                        t = next((x['title'] for x in canary_file if str(x['id']) == m_id), f"ID: {m_id}")
-                        missing_titles.append(t)
-                    
-                    list_text = "\n".join([f"• {t}" for t in missing_titles])
-                    send_canary_alert(settings, "Multiple Files" if len(missing_titles)>1 else missing_titles[0], 
-                                      "MISSING", 
-                                      "The following configured Canary files were not found in Plex:", 
-                                      detail_field={"name": "Missing Files", "value": list_text, "inline": False})
+                for ctx in contexts:
+                    missing_ids = set(ctx['canary_ids']) - ctx['found_canary_ids']
+                    if missing_ids and ctx.get('item_count'): # Ensure scan actually ran
+                        missing_titles = []
+                        for m_id in missing_ids:
+                            # Find title from settings
+                            t = next((x['title'] for x in ctx['canary_file'] if str(x['id']) == m_id), f"ID: {m_id}")
+                            missing_titles.append(t)
+                        
+                        list_text = "\n".join([f"• {t}" for t in missing_titles])
+                        send_canary_alert(settings, "Multiple Files" if len(missing_titles)>1 else missing_titles[0], 
+                                          "MISSING", 
+                                          "The following configured Canary files were not found in Plex:", 
+                                          detail_field={"name": "Missing Files", "value": list_text, "inline": False})
 
                 # Summary Notifications
                 should_send = False
                 work_done = (state['scanned'] > 0 or state['skipped'] > 0 or state['failed'] > 0)
                 is_recovery = False
+                new_discord_failures = [f for ctx in contexts for f in ctx['new_discord_failures']]
                 
                 if work_done:
                     has_new_failures = len(new_discord_failures) > 0
@@ -660,12 +2251,52 @@ def run_scan_loop():
                 state['status'] = 'Sleeping'
                 state['current_file'] = ''
                 state['current_activity'] = ''
+                state['current_library'] = ''
                 state['progress'] = 100
+                state['eta_seconds'] = None
+                for server_state in state['servers'].values():
+                    if not server_state['status'].startswith('Error'):
+                        server_state['status'] = 'Sleeping'
+                    server_state['eta_seconds'] = None
+                    server_state['current_file'] = ''
+                    server_state['current_activity'] = ''
+                    server_state['current_library'] = ''
                 
-                sleep_time = int(settings.get('scan_interval', 3600))
-                for _ in range(sleep_time):
+                # Sleep until the next library is due. With live notifications, libraries without
+                # their own schedule only run as a slow reconciliation pass (see default_scan_interval)
+                conn = connect_db()
+                try:
+                    wake_at = max(next_wake_time(conn, settings, servers), time.time() + 1)
+                finally:
+                    conn.close()
+                listener_checked = time.time()
+                while time.time() < wake_at:
                     if stop_event.is_set(): break
                     if restart_event.is_set(): break
+                    # The websocket drops when Plex restarts and doesn't reconnect by itself.
+                    # Restart it, and if that fails fall back to scan_interval polling.
+                    if settings.get('plex_events_enabled', False) and time.time() - listener_checked >= LISTENER_CHECK_INTERVAL:
+                        listener_checked = time.time()
+                        for ctx in contexts:
+                            if ctx['plex'] and not (ctx['listener'] and ctx['listener'].is_alive()):
+                                print(f"[{ctx['server']['name']}] Plex event listener is down, restarting")
+                                ctx['listener'] = sync_event_listener(ctx)
+                                if not ctx['listener']:
+                                    conn = connect_db()
+                                    try:
+                                        wake_at = min(wake_at, max(next_wake_time(conn, settings, servers), time.time() + 1))
+                                    finally:
+                                        conn.close()
+                    for ctx in contexts:
+                        if ctx['listener']:
+                            batch = ctx['listener'].pop_batch()
+                            if batch:
+                                run_event_batch(ctx, batch)
+                    for ctx in contexts:
+                        if ctx['plex']:
+                            job_work = claim_scan_jobs(ctx)
+                            if job_work:
+                                run_batch(ctx, job_work)
                     time.sleep(1)
 
         except Exception as e:
@@ -673,11 +2304,152 @@ def run_scan_loop():
             state['status'] = f"Error: {str(e)}"
             time.sleep(60)
 
+# --- SCANNER PROCESS CHANNEL ---
+
+def is_external():
+    return SCANNER_MODE == 'external'
+
+def handle_command(command, payload=None):
+    """Applies a control command inside the scanner. Returns a JSON-able result."""
+    if command == 'restart':
+        restart_event.set()
+        return {'success': True}
+    if command == 'stop':
+        stop_event.set()
+        return {'success': True}
+    if command == 'profile':
+        return profiler.handle(payload.get('action'), payload.get('options'))
+    return {'success': False, 'error': f"Unknown command: {command}"}
+
+def send_command(command, payload=None):
+    """
+    Sends a control command to the scanner. Embedded scanners handle it right
+    away; an external scanner picks it up from the control table.
+    Returns the command id (None when handled in-process).
+    """
+    if not is_external():
+        handle_command(command, payload)
+        return None
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        c.execute("INSERT INTO scanner_control (command, payload, created_at) VALUES (?, ?, ?)",
+                  (command, json.dumps(payload), time.time()))
+        conn.commit()
+        return c.lastrowid
+    except sqlite3.Error as e:
+        print(f"Could not reach scanner process: {e}")
+        return None
+    finally:
+        conn.close()
+
+def run_profile_command(action, options=None, timeout=30):
+    """Runs a profiling action (see profiler.py) in whichever process runs the scanner."""
+    payload = {'action': action, 'options': options or {}}
+    if not is_external():
+        return handle_command('profile', payload)
+    command_id = send_command('profile', payload)
+    if command_id is None:
+        return {'success': False, 'error': 'Could not reach scanner process'}
+    return get_command_result(command_id, timeout) or {'success': False, 'error': 'Scanner process did not answer'}
+
+def get_command_result(command_id, timeout=10):
+    """Waits for an external scanner to handle a command and returns its result."""
+    deadline = time.time() + timeout
+    conn = connect_db()
+    try:
+        while time.time() < deadline:
+            row = conn.execute("SELECT handled_at, result FROM scanner_control WHERE id=?", (command_id,)).fetchone()
+            if row and row[0] is not None:
+                return json.loads(row[1]) if row[1] else None
+            time.sleep(0.2)
+    finally:
+        conn.close()
+    return {'success': False, 'error': 'Scanner did not respond'}
+
+def publish_state(conn):
+    with state_lock:
+        data = json.dumps(state, default=str)
+    conn.execute("INSERT OR REPLACE INTO scanner_state (id, pid, updated_at, state) VALUES (1, ?, ?, ?)",
+                 (os.getpid(), time.time(), data))
+    conn.commit()
+
+def read_state():
+    """Returns the scanner state, from memory or from the channel written by an external scanner."""
+    if not is_external():
+        return state
+    try:
+        conn = connect_db()
+        try:
+            row = conn.execute("SELECT updated_at, state FROM scanner_state WHERE id=1").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        row = None
+    if not row:
+        return dict(state, status='Scanner Offline')
+    published = json.loads(row[1])
+    if time.time() - row[0] > STATE_STALE_AFTER:
+        published['status'] = 'Scanner Offline'
+    return published
+
+def run_control_loop():
+    """Publishes state and executes queued commands for the standalone scanner."""
+    conn = connect_db()
+    last_cleanup = 0
+    while True:
+        try:
+            publish_state(conn)
+            rows = conn.execute("SELECT id, command, payload FROM scanner_control WHERE handled_at IS NULL ORDER BY id").fetchall()
+            for command_id, command, payload in rows:
+                try:
+                    result = handle_command(command, json.loads(payload) if payload else None)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                conn.execute("UPDATE scanner_control SET handled_at=?, result=? WHERE id=?",
+                             (time.time(), json.dumps(result, default=str), command_id))
+                conn.commit()
+            if time.time() - last_cleanup > 3600:
+                conn.execute("DELETE FROM scanner_control WHERE handled_at < ?", (time.time() - 86400,))
+                conn.commit()
+                last_cleanup = time.time()
+        except Exception as e:
+            print(f"Control channel error: {e}")
+        if stop_event.is_set():
+            break
+        time.sleep(1)
+    conn.close()
+
 _thread_started = False
 def start_background_thread():
     global _thread_started
     if _thread_started: return
     _thread_started = True
-    t = threading.Thread(target=run_scan_loop)
+    # Thread names starting with 'scanner' are what the profiler samples
+    t = threading.Thread(target=run_scan_loop, name='scanner')
     t.daemon = True
-    t.start()
\ No newline at end of file
+    t.start()
+
+def main():
+    """Entry point for running the scanner as its own process."""
+    def handle_signal(signum, frame):
+        print("Stopping scanner...")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    init_db().close()
+    control = threading.Thread(target=run_control_loop, daemon=True)
+    control.start()
+    threading.current_thread().name = 'scanner'
+    print("Findrr scanner started")
+    run_scan_loop()
+    control.join(timeout=5)
+
+    state['status'] = 'Stopped'
+    conn = connect_db()
+    publish_state(conn)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
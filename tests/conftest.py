@@ -0,0 +1,57 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The logic under test doesn't talk to Plex or the network. Where requests or
+# plexapi aren't installed, empty modules let scanner.py import anyway.
+for name in ('requests', 'plexapi', 'plexapi.server'):
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = types.ModuleType(name)
+if not hasattr(sys.modules['plexapi.server'], 'PlexServer'):
+    sys.modules['plexapi.server'].PlexServer = None
+
+import scanner
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh history database; returns an open connection to it."""
+    monkeypatch.setattr(scanner, 'DB_PATH', str(tmp_path / 'history.db'))
+    conn = scanner.init_db()
+    yield conn
+    conn.close()
+
+
+class Part:
+    def __init__(self, file, size=100, id=None):
+        self.file = file
+        self.size = size
+        self.id = id or hash(file)
+        self.updatedAt = 0
+
+
+class Media:
+    def __init__(self, *parts):
+        self.parts = list(parts)
+
+
+class Item:
+    """The parts of a plexapi Movie/Episode that the scanner reads without a server."""
+    def __init__(self, rating_key, *files, title='Item', type='movie'):
+        self.ratingKey = rating_key
+        self.title = title
+        self.type = type
+        self.year = 2000
+        self.addedAt = None
+        self.media = [Media(*(Part(f) for f in files))]
+
+
+@pytest.fixture
+def make_item():
+    return Item
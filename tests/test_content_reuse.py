@@ -0,0 +1,22 @@
+import scanner
+
+
+def fingerprint(path, server=scanner.DEFAULT_SERVER):
+    return {'server': server, 'path': path, 'size': 100, 'mtime': 0, 'content_id': '100:abc'}
+
+
+def test_reuses_probe_result_from_same_server(db):
+    scanner.update_db(db, fingerprint('/movies/a.mkv'), 'PASS', library_name='Movies')
+    assert scanner.find_reusable_result(db, fingerprint('/kids/a.mkv'), 7, {}, 'Kids') == ('/movies/a.mkv', 'PASS', 'OK')
+
+
+def test_ignores_other_servers(db):
+    scanner.update_db(db, fingerprint('/movies/a.mkv', server='remote'), 'PASS', library_name='Movies')
+    assert scanner.find_reusable_result(db, fingerprint('/movies/a.mkv'), 7, {}, 'Movies') is None
+
+
+def test_ignores_reused_verdicts_and_other_languages(db):
+    settings = {'per_library_settings': {'Kids': {'target_languages': 'no'}}}
+    scanner.update_db(db, fingerprint('/movies/a.mkv'), 'PASS', library_name='Movies')
+    scanner.update_db(db, fingerprint('/copies/a.mkv'), 'PASS', library_name='Kids', verdict_source='reused')
+    assert scanner.find_reusable_result(db, fingerprint('/kids/a.mkv'), 7, settings, 'Kids') is None
@@ -0,0 +1,105 @@
+import collections
+import types
+
+import pytest
+
+import plex_events
+import scanner
+from plex_events import PlexEventListener
+
+
+def timeline(*entries):
+    return {'type': 'timeline', 'size': len(entries), 'TimelineEntry': list(entries)}
+
+
+def entry(item_id, type=1, state=5, **extra):
+    return {'identifier': 'com.plexapp.plugins.library', 'itemID': item_id, 'type': type,
+            'state': state, **extra}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(plex_events.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def listener():
+    # Never started, alerts are fed to _on_alert directly as the websocket would
+    return PlexEventListener(plex=None, debounce=30, max_wait=300)
+
+
+def test_on_alert_keeps_finished_movies_and_episodes(listener, clock):
+    listener._on_alert(timeline(entry(10, type=1), entry(11, type=4)))
+    assert listener.pending_count() == 2
+
+
+def test_on_alert_ignores_other_alerts(listener, clock):
+    listener._on_alert({'type': 'playing', 'PlaySessionStateNotification': [{'ratingKey': 10}]})
+    listener._on_alert(timeline(
+        entry(1, state=0),                                    # still processing
+        entry(2, state=9),                                    # deleted
+        entry(3, metadataState='deleted'),
+        entry(4, type=2),                                     # show
+        entry(5, identifier='com.plexapp.plugins.other'),
+        entry(None),
+    ))
+    assert listener.pending_count() == 0
+
+
+def test_pop_batch_waits_for_quiet_period(listener, clock):
+    listener._on_alert(timeline(entry(1)))
+    clock[0] += 20
+    listener._on_alert(timeline(entry(2)))
+    clock[0] += 20
+    assert listener.pop_batch() == []
+    clock[0] += 10
+    assert listener.pop_batch() == ['1', '2']
+    assert listener.pop_batch() == []
+
+
+def test_pop_batch_deduplicates_in_order_of_last_event(listener, clock):
+    listener._on_alert(timeline(entry(1), entry(2)))
+    clock[0] += 1
+    listener._on_alert(timeline(entry(1)))
+    clock[0] += 30
+    assert listener.pop_batch() == ['2', '1']
+
+
+def test_pop_batch_flushes_after_max_wait(listener, clock):
+    for n in range(11):
+        listener._on_alert(timeline(entry(n + 1)))
+        clock[0] += 29
+    # Events keep arriving inside the debounce, but the first one is 319s old
+    assert len(listener.pop_batch()) == 11
+
+
+def test_event_work_forces_only_changed_files(db, make_item):
+    unchanged = make_item(1, '/movies/a.mkv')
+    resized = make_item(2, '/movies/b.mkv')
+    new = make_item(3, '/movies/c.mkv')
+    for item in (unchanged, resized):
+        part = item.media[0].parts[0]
+        scanner.update_db(db, scanner.get_file_fingerprint(item, part), 'PASS')
+    resized.media[0].parts[0].size += 1
+
+    work = scanner.event_work(db, scanner.DEFAULT_SERVER, [('Movies', unchanged), ('Movies', resized), ('Movies', new)])
+    assert [(item.ratingKey, force) for _, item, force, job in work] == [(1, False), (2, True), (3, True)]
+
+
+def test_queue_event_items_pushes_batch_to_front(db, make_item, clock, monkeypatch):
+    items = {10: make_item(10, '/tv/s01e01.mkv', type='episode'), 11: make_item(11, '/other/x.mkv')}
+    items[10].librarySectionTitle = 'TV'
+    items[11].librarySectionTitle = 'Not scanned'
+    listener = PlexEventListener(plex=None, debounce=30)
+    listener._on_alert(timeline(entry(10, type=4), entry(11)))
+    clock[0] += 30
+
+    ctx = {'listener': listener, 'plex': types.SimpleNamespace(fetchItem=items.get),
+           'server': {'name': scanner.DEFAULT_SERVER, 'libraries': ['TV']}}
+    monkeypatch.setattr(scanner, 'bump', lambda ctx, key, amount=1: None)
+    queue = collections.deque([('TV', 'queued before', False, None)])
+    scanner.queue_event_items(db, ctx, queue)
+    assert [(lib, getattr(item, 'ratingKey', item), force) for lib, item, force, job in queue] == \
+        [('TV', 10, True), ('TV', 'queued before', False)]
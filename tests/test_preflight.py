@@ -0,0 +1,104 @@
+import pytest
+
+import preflight
+from preflight import OK, WARN, FAIL, UNKNOWN
+
+
+# --- Matroska ---
+
+def ebml(element_id, payload=b'', size=None):
+    size = len(payload) if size is None else size
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + b'\x01' + size.to_bytes(7, 'big') + payload
+
+
+def track(track_type):
+    return ebml(preflight.TRACK_ENTRY, ebml(preflight.TRACK_TYPE, bytes([track_type])))
+
+
+HEADER = ebml(preflight.EBML_HEADER, ebml(0x4282, b'matroska'))
+TRACKS = ebml(preflight.TRACKS, track(1) + track(2) + track(17))
+CLUSTER = ebml(preflight.CLUSTER, b'\x00' * 64)
+VOID = ebml(0xEC, b'\x00' * 16)
+
+
+def mkv(*children, segment_size=None):
+    body = b''.join(children)
+    return HEADER + ebml(preflight.SEGMENT, body, size=segment_size) + body
+
+
+# --- MP4 ---
+
+def box(box_type, payload=b'', size=None):
+    return (8 + len(payload) if size is None else size).to_bytes(4, 'big') + box_type + payload
+
+
+def trak(handler):
+    return box(b'trak', box(b'mdia', box(b'hdlr', b'\x00' * 8 + handler + b'\x00' * 12)))
+
+
+MOOV = box(b'moov', trak(b'vide') + trak(b'soun'))
+FTYP = box(b'ftyp', b'isom\x00\x00\x02\x00')
+MDAT = box(b'mdat', b'\x00' * 64)
+
+
+# --- AVI / MPEG-TS ---
+
+def avi(riff_size=None, header_list=b'hdrl'):
+    body = b'AVI ' + b'LIST' + (4).to_bytes(4, 'little') + header_list + b'\x00' * 64
+    return b'RIFF' + (riff_size or len(body)).to_bytes(4, 'little') + body
+
+
+def transport_stream(packet_size):
+    timestamp = b'\x00' * (packet_size - 188)
+    return (timestamp + b'\x47' + b'\x00' * 187) * 5
+
+
+CASES = [
+    # name, file name, content, status, container
+    ('matroska', 'a.mkv', mkv(TRACKS, CLUSTER), OK, 'matroska'),
+    ('matroska tracks after void', 'a.mkv', mkv(VOID, TRACKS), OK, 'matroska'),
+    ('matroska truncated segment', 'a.mkv', mkv(TRACKS, CLUSTER, segment_size=10 ** 6), WARN, 'matroska'),
+    ('matroska media before tracks', 'a.mkv', mkv(CLUSTER, TRACKS), WARN, 'matroska'),
+    ('matroska without tracks', 'a.mkv', mkv(VOID), FAIL, 'matroska'),
+    ('matroska empty track table', 'a.mkv', mkv(ebml(preflight.TRACKS)), FAIL, 'matroska'),
+    ('matroska truncated before tracks', 'a.mkv', mkv(VOID, segment_size=10 ** 6), FAIL, 'matroska'),
+    ('matroska without segment', 'a.mkv', HEADER + VOID, FAIL, 'matroska'),
+    ('mp4', 'a.mp4', FTYP + MOOV + MDAT, OK, 'mp4'),
+    ('mp4 moov at end', 'a.mp4', FTYP + MDAT + MOOV, OK, 'mp4'),
+    ('mov starting with uuid', 'a.mov', box(b'uuid', b'\x00' * 16) + FTYP + MOOV + MDAT, OK, 'mp4'),
+    ('mp4 segment starting with styp', 'a.mp4', box(b'styp', b'msdh') + MOOV + MDAT, OK, 'mp4'),
+    ('mov starting with pnot', 'a.mov', box(b'pnot', b'\x00' * 12) + MOOV + MDAT, OK, 'mp4'),
+    ('mp4 truncated mdat', 'a.mp4', FTYP + MOOV + box(b'mdat', b'\x00' * 8, size=10 ** 6), WARN, 'mp4'),
+    ('mp4 without moov', 'a.mp4', FTYP + MDAT, FAIL, 'mp4'),
+    ('mp4 truncated moov', 'a.mp4', FTYP + box(b'moov', trak(b'vide'), size=10 ** 6), FAIL, 'mp4'),
+    ('mp4 corrupt box size', 'a.mp4', FTYP + box(b'free', size=4) + MOOV, FAIL, 'mp4'),
+    ('mp4 moov without tracks', 'a.mp4', FTYP + box(b'moov', box(b'mvhd', b'\x00' * 8)), FAIL, 'mp4'),
+    ('avi', 'a.avi', avi(), OK, 'avi'),
+    ('avi truncated', 'a.avi', avi(riff_size=10 ** 6), WARN, 'avi'),
+    ('avi without header list', 'a.avi', avi(header_list=b'movi'), FAIL, 'avi'),
+    ('mpeg-ts', 'a.ts', transport_stream(188), OK, 'mpegts'),
+    ('bdav m2ts saved as ts', 'a.ts', transport_stream(192), OK, 'mpegts'),
+    ('m2ts', 'a.m2ts', transport_stream(192), OK, 'mpegts'),
+    ('empty', 'a.mkv', b'', FAIL, None),
+    ('unrecognised header', 'a.mkv', b'not a matroska file' * 10, UNKNOWN, 'matroska'),
+    ('starts with zeros', 'a.mp4', b'\x00' * 8192, WARN, 'mp4'),
+    ('unknown container', 'a.wmv', b'\x30\x26\xb2\x75' + b'\x00' * 64, UNKNOWN, None),
+]
+
+
+@pytest.mark.parametrize('name, filename, content, status, container', CASES, ids=[c[0] for c in CASES])
+def test_check_file(tmp_path, name, filename, content, status, container):
+    path = tmp_path / filename
+    path.write_bytes(content)
+    result = preflight.check_file(str(path))
+    assert (result['status'], result['container']) == (status, container), result['reason']
+
+
+def test_reports_stream_counts(tmp_path):
+    path = tmp_path / 'a.mkv'
+    path.write_bytes(mkv(TRACKS))
+    assert preflight.check_file(str(path))['streams'] == {'video': 1, 'audio': 1, 'subtitle': 1}
+
+
+def test_missing_file_is_unknown(tmp_path):
+    assert preflight.check_file(str(tmp_path / 'gone.mkv'))['status'] == UNKNOWN
@@ -0,0 +1,56 @@
+import collections
+import math
+
+import scanner
+
+
+def run_cycles(shares, cycles):
+    credit = {}
+    per_cycle = []
+    per_group = collections.Counter()
+    for _ in range(cycles):
+        counts, carried = scanner.allocate_reverify(shares, credit)
+        credit.update(carried)
+        per_cycle.append(sum(counts.values()))
+        per_group.update(counts)
+    return per_cycle, per_group
+
+
+def test_cycle_total_stays_near_the_share():
+    # 1000 files in 100 profiles, hourly cycles, reverify_days=30
+    shares = {('Movies', f"sig{n}"): 10 / 720 for n in range(100)}
+    per_cycle, per_group = run_cycles(shares, 720)
+    assert max(per_cycle) <= math.ceil(sum(shares.values()))
+    assert sum(per_cycle) in (999, 1000)
+    # Every profile still takes its turn
+    assert set(per_group.values()) <= {9, 10, 11}
+
+
+def test_large_groups_get_proportionally_more():
+    shares = {('Movies', 'big'): 900 * 0.01, ('Movies', 'small'): 100 * 0.01}
+    per_cycle, per_group = run_cycles(shares, 100)
+    assert per_cycle == [10] * 100
+    assert per_group == {('Movies', 'big'): 900, ('Movies', 'small'): 100}
+
+
+def test_nothing_due_takes_nothing():
+    counts, carried = scanner.allocate_reverify({('Movies', 'sig'): 0.3}, {})
+    assert counts == {('Movies', 'sig'): 0}
+    assert carried == {('Movies', 'sig'): 0.3}
+
+
+def test_load_reverify_set_is_bounded(db, monkeypatch):
+    monkeypatch.setattr(scanner, '_reverify_credit', {})
+    for n in range(1000):
+        fingerprint = {'server': scanner.DEFAULT_SERVER, 'path': f"/movies/{n}.mkv", 'size': 1, 'mtime': 0,
+                       'signature': f"sig{n % 100}"}
+        scanner.update_db(db, fingerprint, 'PASS', library_name='Movies')
+    settings = {'reverify_fraction': 1 / 720, 'reverify_boost_days': 0}
+    ctx = {'settings': settings, 'server': {'name': scanner.DEFAULT_SERVER}, 'plex': None, 'libraries': ['Movies']}
+
+    picked = []
+    for _ in range(72):
+        scanner.load_reverify_set(ctx)
+        picked.append(len(ctx['reverify']))
+    assert max(picked) <= 2
+    assert sum(picked) == 100
@@ -0,0 +1,62 @@
+import threading
+
+import scanner
+
+
+def claim(db, monkeypatch, items, job_request={'library': 'TV'}):
+    monkeypatch.setattr(scanner, 'load_job_items', lambda ctx, job_request: items)
+    job_id = scanner.create_scan_job(scanner.DEFAULT_SERVER, job_request)
+    work = scanner.claim_scan_jobs({'server': {'name': scanner.DEFAULT_SERVER}, 'plex': None})
+    return job_id, work
+
+
+def finish(db, work):
+    for lib_name, item, force, job in work:
+        for media in item.media:
+            for part in media.parts:
+                scanner.record_job_result(db, job, part.file, item.title, 'PASS')
+
+
+def test_multi_episode_file_counts_once(db, make_item, monkeypatch):
+    episodes = [make_item(1, '/tv/Show/S01E01-E02.mkv', type='episode'),
+                make_item(2, '/tv/Show/S01E01-E02.mkv', type='episode'),
+                make_item(3, '/tv/Show/S01E03.mkv', type='episode')]
+    job_id, work = claim(db, monkeypatch, [('TV', e) for e in episodes])
+
+    assert [item.ratingKey for _, item, force, job in work] == [1, 3]
+    assert scanner.get_scan_job(job_id)['total'] == 2
+    finish(db, work)
+    job = scanner.get_scan_job(job_id)
+    assert (job['status'], job['progress']) == ('done', 100)
+
+
+def test_repeated_rating_keys_finish(db, make_item, monkeypatch):
+    item = make_item(1, '/movies/a.mkv')
+    job_id, work = claim(db, monkeypatch, [('Movies', item), ('Movies', item)], {'rating_keys': [1, 1]})
+    finish(db, work)
+
+    scanner.reset_scan_jobs(db)
+    assert scanner.get_scan_job(job_id)['status'] == 'done'
+
+
+def test_item_with_a_new_version_is_kept(db, make_item, monkeypatch):
+    first = make_item(1, '/movies/a.mkv')
+    both = make_item(2, '/movies/a.mkv', '/movies/a-part2.mkv')
+    job_id, work = claim(db, monkeypatch, [('Movies', first), ('Movies', both)])
+
+    assert len(work) == 2
+    assert scanner.get_scan_job(job_id)['total'] == 2
+
+
+def test_idle_server_runs_jobs_until_cycle_ends(monkeypatch):
+    ran = []
+    cycle_done = threading.Event()
+    monkeypatch.setattr(scanner, 'claim_scan_jobs', lambda ctx: [] if ran else ['job work'])
+
+    def run_batch(ctx, work):
+        ran.append(work)
+        cycle_done.set()
+    monkeypatch.setattr(scanner, 'run_batch', run_batch)
+
+    scanner.serve_idle_server({'listener': None, 'cycle_done': cycle_done})
+    assert ran == [['job work']]
@@ -0,0 +1,124 @@
+import datetime
+import time
+
+import pytest
+
+import budget
+import scanner
+
+WEEKLY = {'per_library_settings': {'4K': {'scan_interval': 7 * 86400}}, 'scan_interval': 3600}
+SERVER = {'name': scanner.DEFAULT_SERVER, 'libraries': ['4K']}
+
+
+def test_failed_scan_is_retried_soon(db, monkeypatch):
+    monkeypatch.setattr(scanner, '_library_retry', {})
+    scanner.mark_libraries_scanned(SERVER['name'], ['4K'])
+    db.execute("UPDATE library_schedule SET last_run=last_run - ?", (8 * 86400,))
+    db.commit()
+    assert scanner.due_libraries(db, WEEKLY, SERVER) == ['4K']
+
+    scanner.retry_libraries_later(WEEKLY, SERVER['name'], ['4K'])
+    assert scanner.due_libraries(db, WEEKLY, SERVER) == []
+    wait = scanner.next_wake_time(db, WEEKLY, [SERVER]) - time.time()
+    assert 290 < wait <= scanner.LIBRARY_RETRY_DELAY
+    assert scanner.due_libraries(db, WEEKLY, SERVER, now=time.time() + 301) == ['4K']
+
+
+def test_successful_scan_clears_the_retry(db, monkeypatch):
+    monkeypatch.setattr(scanner, '_library_retry', {})
+    scanner.retry_libraries_later(WEEKLY, SERVER['name'], ['4K'])
+    scanner.mark_libraries_scanned(SERVER['name'], ['4K'])
+    assert scanner._library_retry == {}
+    wait = scanner.next_wake_time(db, WEEKLY, [SERVER]) - time.time()
+    assert wait > 6 * 86400
+
+
+# --- Time windows (budget.py) ---
+
+MONDAY = datetime.datetime(2026, 10, 19, 12, 0)
+
+
+def at(day, hhmm):
+    hours, minutes = map(int, hhmm.split(':'))
+    return (MONDAY + datetime.timedelta(days=day)).replace(hour=hours, minute=minutes)
+
+
+@pytest.mark.parametrize('window, expected', [
+    ('02:00-05:00', (120, 300)),
+    ('22:00-06:00', (1320, 360)),
+    (' 00:00 - 24:00 ', (0, 1440)),
+])
+def test_parse_window(window, expected):
+    assert budget.parse_window(window) == expected
+
+
+@pytest.mark.parametrize('window', ['nights', '25:00-01:00', '01:60-02:00', '1:00-2:00-3:00', '', None, 5])
+def test_parse_window_rejects(window):
+    with pytest.raises(ValueError):
+        budget.parse_window(window)
+
+
+@pytest.mark.parametrize('hhmm, inside', [
+    ('21:59', False), ('22:00', True), ('23:59', True), ('00:00', True), ('05:59', True), ('06:00', False),
+])
+def test_in_window_across_midnight(hhmm, inside):
+    assert budget.in_window('22:00-06:00', at(0, hhmm)) == inside
+
+
+def test_minutes_until_window_picks_the_nearest_start():
+    assert budget.minutes_until_window(['02:00-05:00', '13:30-14:00'], at(0, '12:00')) == 90
+    assert budget.minutes_until_window(['02:00-05:00'], at(0, '23:00')) == 180
+
+
+# --- Library schedules ---
+
+def next_run(schedule, last_run, default_interval=3600):
+    settings = {'per_library_settings': {'Lib': schedule}}
+    return datetime.datetime.fromtimestamp(
+        scanner.next_library_run(settings, 'Lib', last_run.timestamp(), default_interval))
+
+
+def test_never_scanned_is_due_now():
+    assert scanner.next_library_run({}, 'Lib', None, 3600) == 0
+
+
+@pytest.mark.parametrize('schedule, expected', [
+    ({}, at(0, '13:00')),                                                     # default interval
+    ({'scan_interval': 86400}, at(1, '12:00')),
+    ({'scan_interval': 3600, 'scan_window': '02:00-05:00'}, at(1, '02:00')),
+    ({'scan_interval': 3600, 'scan_window': '22:00-06:00'}, at(0, '22:00')),
+    ({'scan_interval': 12 * 3600, 'scan_window': '22:00-06:00'}, at(1, '00:00')),  # inside, past midnight
+    ({'scan_interval': 3600, 'scan_window': ['02:00-03:00', '18:00-19:00']}, at(0, '18:00')),
+    ({'scan_interval': 3600, 'scan_days': ['sat']}, at(5, '00:00')),
+    ({'scan_interval': 3600, 'scan_days': ['Monday', 'tue']}, at(0, '13:00')),
+    ({'scan_interval': 7 * 86400, 'scan_window': '02:00-05:00', 'scan_days': ['sat']}, at(12, '02:00')),
+    ({'scan_interval': 3600, 'scan_window': '23:00-01:00', 'scan_days': ['sun']}, at(6, '00:00')),
+])
+def test_next_library_run(schedule, expected):
+    assert next_run(schedule, MONDAY) == expected
+
+
+def test_invalid_schedule_falls_back_to_default_interval(capsys):
+    assert next_run({'scan_window': 'nights', 'scan_interval': 86400}, MONDAY) == at(0, '13:00')
+    assert 'Ignoring the schedule' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('schedule', [
+    {'scan_interval': 'weekly'},
+    {'scan_interval': 0},
+    {'scan_interval': True},
+    {'scan_window': 'nights'},
+    {'scan_window': {'start': '02:00'}},
+    {'scan_days': ['funday']},
+    {'scan_days': 'sat,sun'},
+    {'scan_days': [6]},
+])
+def test_parse_library_schedule_rejects(schedule):
+    with pytest.raises(ValueError):
+        scanner.parse_library_schedule(schedule)
+
+
+def test_parse_library_schedule_normalises():
+    assert scanner.parse_library_schedule({'scan_interval': '86400', 'scan_window': '02:00-05:00',
+                                           'scan_days': 'Saturday'}) == (86400.0, ['02:00-05:00'], ['sat'])
+    assert scanner.parse_library_schedule({}) == (None, [], [])
@@ -0,0 +1,16 @@
+import scanner
+import timeseries
+
+
+def test_run_batch_counts_items(db, make_item, monkeypatch):
+    monkeypatch.setattr(scanner, 'process_item', lambda conn, ctx, lib_name, item, force=False, job=None:
+                        timeseries.record_probe(0.5, 1000))
+    server = scanner.get_servers({'plex_url': 'http://plex:32400', 'plex_token': 'token', 'libraries': ['Movies']})[0]
+    scanner.state['servers'][server['name']] = scanner.new_server_state()
+    ctx = scanner.new_scan_context({'breaker_threshold': 0}, server, plex=object())
+
+    scanner.run_batch(ctx, [('Movies', make_item(n, f'/movies/{n}.mkv'), True, None) for n in range(3)])
+
+    series = timeseries.get_series(db, 0, 2 ** 31, timeseries.RAW)
+    assert [(s['items'], s['probes'], s['bytes_read']) for s in series] == [(3, 3, 3000)]
+    assert series[0]['items_per_sec']
@@ -0,0 +1,113 @@
+import time
+import threading
+
+# Sample resolutions and the bucket size (seconds) each one is rolled up to
+RAW = 'raw'
+HOUR = 'hour'
+DAY = 'day'
+BUCKET_SECONDS = {RAW: 1, HOUR: 3600, DAY: 86400}
+
+# Sample kinds: fixed intervals while scanning, and one sample per finished scan cycle
+INTERVAL = 'interval'
+SCAN = 'scan'
+
+COUNTERS = ('items', 'probes', 'probe_seconds', 'failures', 'bytes_read')
+
+_lock = threading.Lock()
+_windows = {}
+
+def _new_window():
+    window = {name: 0 for name in COUNTERS}
+    window['started'] = time.time()
+    return window
+
+def start_window(kind):
+    """Starts (or restarts) collecting counters for a sample of the given kind."""
+    with _lock:
+        _windows[kind] = _new_window()
+
+def is_open(kind):
+    with _lock:
+        return kind in _windows
+
+def _add(**amounts):
+    with _lock:
+        for window in _windows.values():
+            for name, amount in amounts.items():
+                window[name] += amount
+
+def record_probe(seconds, bytes_read):
+    _add(probes=1, probe_seconds=seconds, bytes_read=bytes_read)
+
+def record_item():
+    _add(items=1)
+
+def record_failure():
+    _add(failures=1)
+
+def close_window(conn, kind, restart=True):
+    """Stores the counters collected since the window started. Empty windows are not stored."""
+    with _lock:
+        window = _windows.pop(kind, None)
+        if restart:
+            _windows[kind] = _new_window()
+    if not window or not (window['items'] or window['probes']):
+        return
+    now = time.time()
+    conn.execute('''INSERT INTO scan_samples (ts, resolution, kind, duration, items, probes, probe_seconds, failures, bytes_read)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                 (window['started'], RAW, kind, now - window['started'],
+                  window['items'], window['probes'], window['probe_seconds'], window['failures'], window['bytes_read']))
+    conn.commit()
+
+def maybe_close_interval(conn, interval):
+    """Stores an interval sample once `interval` seconds have passed since the last one."""
+    with _lock:
+        window = _windows.get(INTERVAL)
+        due = window is not None and time.time() - window['started'] >= interval
+    if due:
+        close_window(conn, INTERVAL)
+
+def _rollup(conn, source, target, older_than):
+    bucket = BUCKET_SECONDS[target]
+    # Only whole buckets, so a bucket is never split between two rollups
+    cutoff = int(older_than // bucket) * bucket
+    conn.execute(f'''INSERT INTO scan_samples (ts, resolution, kind, duration, items, probes, probe_seconds, failures, bytes_read)
+                     SELECT CAST(ts / {bucket} AS INTEGER) * {bucket}, ?, kind, SUM(duration), SUM(items), SUM(probes),
+                            SUM(probe_seconds), SUM(failures), SUM(bytes_read)
+                     FROM scan_samples WHERE resolution=? AND ts < ?
+                     GROUP BY kind, CAST(ts / {bucket} AS INTEGER)''', (target, source, cutoff))
+    conn.execute("DELETE FROM scan_samples WHERE resolution=? AND ts < ?", (source, cutoff))
+
+def downsample(conn, raw_days=2, hourly_days=30):
+    """Rolls raw samples older than raw_days into hourly ones, and hourly older than hourly_days into daily."""
+    now = time.time()
+    _rollup(conn, RAW, HOUR, now - raw_days * 86400)
+    _rollup(conn, HOUR, DAY, now - hourly_days * 86400)
+    conn.commit()
+
+def get_series(conn, since, until, resolution=HOUR, kind=INTERVAL):
+    """
+    Returns the samples between since and until (epoch seconds), summed into
+    buckets of the requested resolution. Older data may only exist at a
+    coarser resolution, in which case its buckets are returned as they are.
+    """
+    bucket = BUCKET_SECONDS[resolution]
+    c = conn.cursor()
+    c.execute(f'''SELECT CAST(ts / {bucket} AS INTEGER) * {bucket} AS bucket, SUM(duration), SUM(items), SUM(probes),
+                         SUM(probe_seconds), SUM(failures), SUM(bytes_read)
+                  FROM scan_samples WHERE kind=? AND ts >= ? AND ts < ?
+                  GROUP BY bucket ORDER BY bucket''', (kind, since, until))
+    series = []
+    for ts, duration, items, probes, probe_seconds, failures, bytes_read in c.fetchall():
+        series.append({
+            'time': ts,
+            'duration': round(duration, 1),
+            'items': items,
+            'items_per_sec': round(items / duration, 3) if duration else None,
+            'probes': probes,
+            'mean_probe_ms': round(probe_seconds * 1000 / probes, 1) if probes else None,
+            'failures': failures,
+            'bytes_read': bytes_read
+        })
+    return series